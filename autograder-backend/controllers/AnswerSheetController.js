@@ -9,7 +9,6 @@ const multer = require("multer");
 const { v4: uuidv4 } = require("uuid");
 const fs = require("fs");
 const os = require("os");
-const { PDFDocument, rgb, StandardFonts } = require("pdf-lib");
 const Question = require("../models/Question");
 const axios = require("axios");
 const path = require("path");
@@ -18,7 +17,6 @@ const cheerio = require("cheerio");
 const { createCanvas } = require("canvas");
 const pdfjsLib = require("pdfjs-dist/build/pdf");
 const Tesseract = require("tesseract.js");
-const fontkit = require('fontkit');
 const Activity = require("../models/Activity");
 const FormData = require('form-data');
 
@@ -547,6 +545,9 @@ console.log("Writing................")
     const formData = new FormData();
     formData.append('pdf', fs.createReadStream(tempPdfPath)); // Ajouter le PDF au formulaire
     formData.append('correct_answers', JSON.stringify(questionsWithAnswers)); // Ajouter d'autres données si nécessaire
+    formData.append('sheet_id', String(answerSheetId)); // Réponses conservées pour une nouvelle correction (POST /regrade)
+    formData.append('exam_id', String(answerSheet.exam_id._id)); // Regroupe les réponses conservées par examen ; sujet vierge s'il est enregistré
+    formData.append('output', 'pdf'); // Copie corrigée jointe aux résultats
 
     const response = await axios.post("http://flask-service:5000/analyze_qcm", formData, {
       headers: {
@@ -555,58 +556,10 @@ console.log("Writing................")
     });
     const results = response.data.results;
     console.log("Results: ", results);
-    let totalPoints = 0;
-
-    // Charger le PDF avec pdf-lib pour modification
-    const pdfDoc = await PDFDocument.load(pdfBytes);
-    const firstPage = pdfDoc.getPage(0);
-
-      // Enregistrer fontkit avec le document PDF
-    pdfDoc.registerFontkit(fontkit);
-
-    // Charger une police Unicode
-    const fontBytes = fs.readFileSync('./assets/DejaVuSans.ttf');
-    const customFont = await pdfDoc.embedFont(fontBytes);
-
-    // Dessiner les résultats
-    results.forEach((result) => {
-      const { question_rect, is_correct, points } = result;
-      const x0 = question_rect.x0-50;
-      const y0 = question_rect.y0;
-      const symbol = is_correct ? '✓' : '✘';
-      const color =  rgb(1, 0, 0);  
-
-      // Dessiner "✓" ou "X" à côté de la réponse de l'étudiant
-      firstPage.drawText(`${symbol}`, {
-        x: x0,
-        y: y0,
-        size: 26,
-        font: customFont,
-        color: color
-      });
-
-      // Dessiner la note à côté du symbole
-      firstPage.drawText(`${is_correct ? points : 0}`, {
-        x: x0 + 15,
-        y: y0,
-        size: 20,
-        font: customFont,
-        color: color  
-      });
-
-      totalPoints += points;
-    });
-
-    // Afficher la note totale sur la première page
-    firstPage.drawText(`Note Totale: ${totalPoints}/20`, {
-      x: 50,
-      y: firstPage.getHeight() - 100,
-      size: 30,
-      font: customFont,
-      color: rgb(1, 0, 0),  // Rouge pour la note totale
-    });
 
-    const correctedPdfBytes = await pdfDoc.save();
+    // Copie corrigée renvoyée par le service (✓/✘ et points sur la page de chaque question)
+    const totalPoints = results.reduce((total, result) => total + result.points, 0);
+    const correctedPdfBytes = Buffer.from(response.data.annotated_pdf, "base64");
     const correctedFileName = `${answerSheetId}_corrected.pdf`;
     const correctedFilePath = path.join("/tmp", correctedFileName);
 
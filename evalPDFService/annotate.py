@@ -0,0 +1,42 @@
+"""Copie corrigée : marques et points écrits dans le PDF déjà ouvert pour l'analyse.
+
+Le backend rechargeait le PDF avec pdf-lib, y intégrait la police DejaVuSans à chaque copie et
+ne dessinait que sur la première page. Ici chaque résultat est marqué sur sa page (page_num),
+avec la mise en page du backend. Les polices sont des polices standard du PDF (ZapfDingbats pour
+✓/✘, Helvetica pour les points) : connues de tous les lecteurs, elles ne sont ni lues ni intégrées.
+"""
+
+RED = (1, 0, 0)
+SYMBOL_SIZE = 26
+POINTS_SIZE = 20
+TOTAL_SIZE = 30
+MARGIN = 50  # Décalage des marques à gauche de la question
+TOTAL_POSITION = (50, 100)  # Note totale, depuis le coin supérieur gauche de la première page
+
+# Codes des symboles dans ZapfDingbats : ✓ (U+2713) et ✘ (U+2718)
+CORRECT_SYMBOL = '3'
+WRONG_SYMBOL = '8'
+
+
+def annotate_sheet(doc, results):
+    """Écrire ✓/✘ et les points de chaque résultat, puis la note totale ; renvoie le PDF corrigé."""
+    total_points = 0
+    for result in results:
+        points = result['points']
+        total_points += points
+        rect = result.get('question_rect')
+        # Résultats mis en cache avant l'ajout de page_num : première page, comme le backend
+        page_num = result.get('page_num') or 0
+        if not rect or page_num >= doc.page_count:
+            continue
+        page = doc[page_num]
+        # Ligne de base une taille de police sous le haut de la question
+        x, y = rect['x0'] - MARGIN, rect['y0'] + SYMBOL_SIZE
+        symbol = CORRECT_SYMBOL if result['is_correct'] else WRONG_SYMBOL
+        page.insert_text((x, y), symbol, fontname='zadb', fontsize=SYMBOL_SIZE, color=RED)
+        page.insert_text((x + 15, y), f"{points if result['is_correct'] else 0:g}", fontname='helv', fontsize=POINTS_SIZE, color=RED)
+
+    if doc.page_count:
+        doc[0].insert_text(TOTAL_POSITION, f"Note Totale: {total_points:g}/20", fontname='helv', fontsize=TOTAL_SIZE, color=RED)
+    # Sans recompression : les flux du PDF d'origine sont recopiés tels quels
+    return doc.tobytes()
@@ -1,21 +1,119 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 import fitz  # PyMuPDF
-from sentence_transformers import SentenceTransformer, util
+import numpy as np
 from bs4 import BeautifulSoup
+from annotate import annotate_sheet
+from batching import EmbeddingBatcher
+from embeddings import EmbeddingCache
+from jobs import JobQueue, QueueFullError
+import omr
+from metrics import (
+    latest_metrics, observe_embedding_cache, observe_model_call, observe_result_cache, observe_sheet, observe_stage,
+    observe_template_pages, timed,
+)
+from responses import ResponseStore
+from results import ResultCache
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import base64
+import gc
+import hashlib
+import os
+import random
 import re
+import threading
 import unicodedata
 import string
 import math
 import json
 import logging
+import time
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Proportion des requêtes dont les structures intermédiaires complètes sont journalisées
+# (questions, annotations, réponses associées) : coûteux, désactivé par défaut
+DEBUG_DUMP_SAMPLE_RATE = float(os.environ.get('DEBUG_DUMP_SAMPLE_RATE', '0'))
+
+def sample_debug_dump():
+    return DEBUG_DUMP_SAMPLE_RATE > 0 and random.random() < DEBUG_DUMP_SAMPLE_RATE
+
 app = Flask(__name__)
 
-# Charger le modèle de sentence-transformers
-model = SentenceTransformer('all-MiniLM-L6-v2')
+# Modèle de sentence-transformers et backend d'inférence CPU. Le service n'utilise que 'fp32'
+# (modèle d'origine). 'int8' (couches linéaires quantifiées dynamiquement) n'est chargé que par
+# 'benchmark/bench.py --real-model --backend-drift' : l'écart de ses similarités cosinus à celles
+# du modèle fp32 n'a pas encore été mesuré sur all-MiniLM-L6-v2, et un écart près du seuil de
+# SIMILARITY_THRESHOLD change les notes.
+EMBEDDING_MODEL = os.environ.get('EMBEDDING_MODEL', 'all-MiniLM-L6-v2')
+EMBEDDING_BACKEND = os.environ.get('EMBEDDING_BACKEND', 'fp32')
+SERVED_BACKENDS = ('fp32',)
+if EMBEDDING_BACKEND not in SERVED_BACKENDS:
+    raise ValueError(f"Unsupported EMBEDDING_BACKEND: {EMBEDDING_BACKEND} (served: {', '.join(SERVED_BACKENDS)})")
+
+def cpu_quota():
+    """Nombre de CPU alloués au conteneur (quota cgroup), au moins 1."""
+    quota = None
+    try:
+        # cgroup v2 : "max 100000" ou "50000 100000"
+        with open('/sys/fs/cgroup/cpu.max') as f:
+            limit, period = f.read().split()[:2]
+            if limit != 'max':
+                quota = int(limit) / int(period)
+    except (OSError, ValueError):
+        try:
+            # cgroup v1
+            with open('/sys/fs/cgroup/cpu/cpu.cfs_quota_us') as f:
+                limit = int(f.read())
+            with open('/sys/fs/cgroup/cpu/cpu.cfs_period_us') as f:
+                period = int(f.read())
+            if limit > 0:
+                quota = limit / period
+        except (OSError, ValueError):
+            pass
+
+    cpu_count = os.cpu_count() or 1
+    if quota is None:
+        return cpu_count
+    return max(1, min(cpu_count, math.ceil(quota)))
+
+def load_model(backend=EMBEDDING_BACKEND):
+    """Charger le modèle d'embeddings avec le backend choisi (EMBEDDING_BACKEND par défaut ;
+    'int8' pour la mesure de son écart seulement)."""
+    start = time.perf_counter()
+    # Importés ici pour mesurer leur durée (plusieurs secondes) : ils sont faits au chargement du module
+    import torch
+    from sentence_transformers import SentenceTransformer
+    logger.info(f"Imported torch and sentence_transformers in {time.perf_counter() - start:.2f}s")
+
+    start = time.perf_counter()
+    # Le quota CPU du pod est bien inférieur au nombre de coeurs visibles : éviter la sursouscription
+    torch.set_num_threads(cpu_quota())
+
+    loaded_model = SentenceTransformer(EMBEDDING_MODEL, device='cpu')
+    if backend == 'int8':
+        loaded_model = torch.quantization.quantize_dynamic(loaded_model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+    elif backend != 'fp32':
+        raise ValueError(f"Unknown EMBEDDING_BACKEND: {backend}")
+    loaded_model.eval()
+    logger.info(f"Loaded {EMBEDDING_MODEL} ({backend}) in {time.perf_counter() - start:.2f}s")
+    return loaded_model
+
+def warm_up_model(loaded_model):
+    """Encoder un lot factice : les initialisations paresseuses de torch et du tokenizer sont
+    faites avant la première copie (et partagées par les workers avec --preload)."""
+    start = time.perf_counter()
+    loaded_model.encode(["Préchauffage du modèle", "Réponse de l'étudiant"], convert_to_tensor=True)
+    logger.info(f"Warmed up the model in {time.perf_counter() - start:.2f}s")
+
+# Chargé une seule fois à l'import : avec 'gunicorn --preload', le modèle est chargé dans le
+# processus maître et ses poids sont partagés (copy-on-write) par tous les workers. Le maître
+# n'accepte aucune connexion avant : un worker qui répond a toujours un modèle prêt
+model = load_model()
+warm_up_model(model)
+# Sortir les objets déjà créés du suivi du ramasse-miettes pour ne pas recopier leurs pages après le fork
+gc.freeze()
 
 def normalize_text(text,remove_spaces=True):
     # Convertir en minuscules
@@ -37,9 +135,84 @@ def normalize_text(text,remove_spaces=True):
     return text
 
 
+def encode_batch(texts):
+    """Appel au modèle pour un lot de textes regroupés par embedding_batcher."""
+    observe_model_call(len(texts))
+    return model.encode(texts, convert_to_tensor=True)
+
+# Textes des requêtes concurrentes d'un worker encodés ensemble : un lot part dès qu'il atteint
+# EMBEDDING_BATCH_SIZE textes, ou EMBEDDING_BATCH_WAIT_MS après l'arrivée de la plus ancienne demande.
+# Sans attente (0), le lot part dès que le modèle est libre et regroupe les textes arrivés pendant
+# le lot précédent : une requête seule n'est pas retardée.
+embedding_batcher = EmbeddingBatcher(
+    encode_batch,
+    max_batch_size=int(os.environ.get('EMBEDDING_BATCH_SIZE', '64')),
+    max_wait_ms=float(os.environ.get('EMBEDDING_BATCH_WAIT_MS', '0')),
+)
+
+# Les tokenizers « uncased » (celui de all-MiniLM-L6-v2) ignorent la casse et les accents
+EMBEDDING_UNCASED = bool(getattr(getattr(model, 'tokenizer', None), 'do_lower_case', False))
+
+def embedding_cache_key(text):
+    """Texte tel que le voit le tokenizer : deux textes de même clé ont le même embedding."""
+    text = ' '.join(text.split())
+    if EMBEDDING_UNCASED:
+        text = ''.join(c for c in unicodedata.normalize('NFD', text.lower()) if unicodedata.category(c) != 'Mn')
+    return text
+
+# Embeddings des textes déjà encodés par le worker (réponses identiques de plusieurs étudiants),
+# bornés à EMBEDDING_CACHE_MAX_MB ; avec EMBEDDING_CACHE_DIR, aussi dans un fichier projeté en
+# mémoire, partagé par les workers et conservé entre les redémarrages
+embedding_cache = EmbeddingCache(
+    f"{EMBEDDING_MODEL}:{EMBEDDING_BACKEND}",
+    int(float(os.environ.get('EMBEDDING_CACHE_MAX_MB', '64')) * 1024 * 1024),
+    directory=os.environ.get('EMBEDDING_CACHE_DIR'),
+    max_disk_bytes=int(float(os.environ.get('EMBEDDING_CACHE_DISK_MB', '256')) * 1024 * 1024),
+)
+
+def encode_texts(texts):
+    """Embeddings de texts (une ligne par texte) : seuls les textes absents du cache passent dans le modèle."""
+    if not embedding_cache.enabled or not texts:
+        return embedding_batcher.submit(texts)
+    import torch
+
+    keys = [embedding_cache_key(text) for text in texts]
+    found = embedding_cache.get_many(keys)
+    vectors = {key: vector for key, (vector, _) in found.items()}
+    results = [found[key][1] if key in found else 'miss' for key in dict.fromkeys(keys)]
+
+    # Chaque texte absent n'est encodé qu'une fois, même s'il revient plusieurs fois dans le lot
+    missing = {}
+    for key, text in zip(keys, texts):
+        if key not in vectors:
+            missing.setdefault(key, text)
+    if missing:
+        embeddings = embedding_batcher.submit(list(missing.values())).cpu().numpy()
+        # Copie de chaque ligne : un vecteur en cache ne retient pas tout le lot en mémoire
+        computed = [(key, np.array(row, dtype=np.float32)) for key, row in zip(missing, embeddings)]
+        embedding_cache.put_many(computed)
+        vectors.update(computed)
+    observe_embedding_cache(results, embedding_cache.bytes)
+    return torch.from_numpy(np.stack([vectors[key] for key in keys]))
+
+@timed('embedding')
 def encode_text(text):
-    encoded = model.encode(text, convert_to_tensor=True)
-    return encoded
+    """Encoder un texte, ou une liste de textes en un seul lot."""
+    if isinstance(text, list):
+        return encode_texts(text)
+    return encode_texts([text])[0]
+
+def pairwise_similarities(texts_a, texts_b):
+    """Similarité cosinus entre texts_a[i] et texts_b[i], calculée en un seul appel au modèle."""
+    if not texts_a:
+        return []
+    embeddings = encode_text(list(texts_a) + list(texts_b))
+    return paired_cosine_similarities(embeddings[:len(texts_a)], embeddings[len(texts_a):])
+
+def paired_cosine_similarities(embeddings_a, embeddings_b):
+    """Similarité cosinus entre les lignes de même rang (la diagonale de util.cos_sim, sans la matrice)."""
+    norms = embeddings_a.norm(dim=1).clamp(min=1e-12) * embeddings_b.norm(dim=1).clamp(min=1e-12)
+    return ((embeddings_a * embeddings_b).sum(dim=1) / norms).tolist()
 
 def clean_text(text):
     """Nettoyer le texte en supprimant les espaces supplémentaires et les retours à la ligne superflus."""
@@ -62,68 +235,160 @@ def rect_to_dict(rect):
 
 
 
-def extract_text_and_annotations(pdf_path):
-    doc = fitz.open(pdf_path)
-    grouped_questions = []
-    student_info = {}  # Dictionnaire pour stocker les informations de l'étudiant
+class PageTextIndex:
+    """Index spatial des caractères d'une page.
+
+    Le texte de la page est extrait une seule fois ('rawdict') ; get_text(rect) renvoie ensuite
+    le même texte que page.get_text("text", clip=rect) sans repasser par MuPDF : un caractère est
+    retenu si sa boîte englobante est entièrement contenue dans le rectangle, et les caractères
+    retenus sont regroupés en lignes avec les mêmes seuils que MuPDF.
+    """
+
+    band_height = 20  # Hauteur (en points) des bandes horizontales de l'index
+
+    # Seuils de MuPDF (relatifs à la taille de police) pour rattacher un caractère à la ligne en cours
+    line_max_dist = 0.8
+    space_min_dist = 0.15
+
+    def __init__(self, page):
+        self.blocks = page.get_text("rawdict")["blocks"]
+        self.lines = []  # Liste de (x0, y0, x1, y1, horizontale, caractères) dans l'ordre de MuPDF
+        self.bands = {}  # Numéro de bande -> index des lignes qui la traversent
+
+        for block in self.blocks:
+            if block["type"] != 0:
+                continue
+            for line in block["lines"]:
+                chars = []
+                for span in line["spans"]:
+                    # Reconstituer le texte du span comme dans le mode 'dict'
+                    span["text"] = "".join(char["c"] for char in span["chars"])
+                    chars.extend((char["bbox"], char["c"], char["origin"], span["size"]) for char in span["chars"])
+                if not chars:
+                    continue
+                x0, y0, x1, y1 = line["bbox"]
+                horizontal = tuple(line["dir"]) == (1, 0)
+                line_index = len(self.lines)
+                self.lines.append((x0, y0, x1, y1, horizontal, chars))
+                for band in range(self._band(y0), self._band(y1) + 1):
+                    self.bands.setdefault(band, []).append(line_index)
+
+    def _band(self, y):
+        return int(math.floor(y / self.band_height))
+
+    def spans(self):
+        """Spans de texte de la page, dans l'ordre de MuPDF."""
+        for block in self.blocks:
+            if block["type"] == 0:
+                for line in block["lines"]:
+                    yield from line["spans"]
+
+    def _separator(self, previous, char):
+        """Séparateur inséré par MuPDF entre deux caractères qui ne se suivaient pas sur la page."""
+        (previous_bbox, _, previous_origin, _), previous_horizontal = previous
+        (_, _, origin, size), horizontal = char
+        if previous_horizontal and horizontal:
+            dist = origin[0] - previous_bbox[2]
+            perp = origin[1] - previous_origin[1]
+            if abs(perp) < size * self.line_max_dist:
+                if -size * self.line_max_dist < dist < size * self.space_min_dist:
+                    return ""
+                if 0 < dist < size * self.line_max_dist:
+                    return " "
+        return "\n"
+
+    def get_text(self, rect):
+        """Texte dont les caractères sont entièrement contenus dans rect."""
+        rx0, ry0, rx1, ry1 = rect
+        if rx0 > rx1 or ry0 > ry1:
+            return ""
+
+        line_indexes = set()
+        for band in range(self._band(ry0), self._band(ry1) + 1):
+            line_indexes.update(self.bands.get(band, ()))
+
+        pieces = []
+        previous = None  # (index de ligne, index du caractère, (caractère, ligne horizontale))
+        for line_index in sorted(line_indexes):
+            x0, y0, x1, y1, horizontal, chars = self.lines[line_index]
+            if x1 < rx0 or x0 > rx1 or y1 < ry0 or y0 > ry1:
+                continue
+            for char_index, char in enumerate(chars):
+                cx0, cy0, cx1, cy1 = char[0]
+                if cx0 < rx0 or cx1 > rx1 or cy0 < ry0 or cy1 > ry1:
+                    continue
+                if previous is not None and (previous[0] != line_index or previous[1] != char_index - 1):
+                    pieces.append(self._separator(previous[2], (char, horizontal)))
+                pieces.append(char[1])
+                previous = (line_index, char_index, (char, horizontal))
 
-    current_question = ""  # Question en cours de traitement
-    current_options = []  # Options associées à la question
-    current_bbox = None  # Boîte englobante de la question et des options
-    current_page_num = None  # Page de la question
+        return "".join(pieces) + "\n" if pieces else ""
 
-    def save_question():
+
+class QuestionGrouper:
+    """Regroupe les blocs de texte imprimés en questions et options, page après page.
+
+    Une question commencée en bas d'une page continue sur la page suivante tant
+    qu'aucune nouvelle question numérotée n'est rencontrée.
+    """
+
+    def __init__(self):
+        self.grouped_questions = []
+        self.current_question = ""  # Question en cours de traitement
+        self.current_options = []  # Options associées à la question
+        self.current_bbox = None  # Boîte englobante de la question et des options
+        self.current_page_num = None  # Page de la question
+
+    def save_question(self):
         """Sauvegarde la question actuelle dans grouped_questions si elle existe."""
-        if current_question:  # Vérifier qu'une question existe
+        if self.current_question:  # Vérifier qu'une question existe
             # Déterminer le type de question
-            if "Vrai ou Faux" in current_question:
+            if "Vrai ou Faux" in self.current_question:
                 question_type = "true_false"
-            elif "Complétez" in current_question:
+            elif "Complétez" in self.current_question:
                 question_type = "fill_in_the_blank"
-            elif "Soulignez" in current_question:
+            elif "Soulignez" in self.current_question:
                 question_type = "highlight_the_correct_answer"
             else:
-                question_type = "multiple_choice" if current_options else "open_ended"
+                question_type = "multiple_choice" if self.current_options else "open_ended"
 
-            grouped_questions.append({
-                'question': current_question.strip(),
-                'options': current_options[:],  # Copie de la liste des options
-                'bbox': current_bbox,  # Bounding box de la question
-                'page_num': current_page_num,  # Numéro de la page
+            self.grouped_questions.append({
+                'question': self.current_question.strip(),
+                'options': self.current_options[:],  # Copie de la liste des options
+                'bbox': self.current_bbox,  # Bounding box de la question
+                'page_num': self.current_page_num,  # Numéro de la page
                 'type': question_type  # Type de la question
             })
 
-    for page_num in range(len(doc)):
-        page = doc.load_page(page_num)
-        blocks = list(page.get_text('blocks'))
-
+    def add_blocks(self, page_num, blocks):
+        """Traiter les blocs (page.get_text('blocks')) d'une page."""
         for block in blocks:
             # Vérifier que le block est valide
             if not block or len(block) < 5:
-                logger.info(f"Skipping invalid block on page {page_num}: {block}")
+                logger.debug("Skipping invalid block on page %s: %s", page_num, block)
                 continue
 
             block_text = block[4] if len(block) > 4 and block[4] is not None else ""
             if not block_text.strip():
-                logger.info(f"Empty or invalid block text on page {page_num}: {block}")
+                logger.debug("Empty or invalid block text on page %s: %s", page_num, block)
                 continue
 
             # Nettoyer le texte et extraire la boîte englobante
             block_text = clean_text(block_text)
             bbox = block[:4] if len(block) >= 4 else None
             if not bbox or not all(isinstance(coord, (int, float)) for coord in bbox):
-                logger.info(f"Invalid bounding box for block on page {page_num}: {block}")
+                logger.debug("Invalid bounding box for block on page %s: %s", page_num, block)
                 continue
 
             # Détection des questions numérotées
             if re.match(r'^(\d+\.|\d+\)|[➊➋➌➍➎➏➐➑➒])', block_text.strip()):
-                save_question()  # Sauvegarder la question précédente avant de passer à la suivante
+                self.save_question()  # Sauvegarder la question précédente avant de passer à la suivante
 
                 # Initialiser une nouvelle question
-                current_question = block_text
-                current_options = []  # Réinitialiser les options
-                current_bbox = bbox  # Enregistrer la boîte englobante de la question
-                current_page_num = page_num  # Enregistrer la page
+                self.current_question = block_text
+                self.current_options = []  # Réinitialiser les options
+                self.current_bbox = bbox  # Enregistrer la boîte englobante de la question
+                self.current_page_num = page_num  # Enregistrer la page
 
             # Détection des options de réponses
             elif re.search(r'([A-Da-d]\)|❍[a-d]\.|[A-Da-d]\.)', block_text.strip()):
@@ -134,31 +399,224 @@ def extract_text_and_annotations(pdf_path):
                 # Ajouter chaque option individuellement
                 for option in options_in_block:
                     if re.match(r'[A-Da-d]\)|❍', option):
-                        current_options.append(option)
+                        self.current_options.append(option)
                     else:
                         # Si l'option n'a pas le préfixe correct, on l'ajoute à la dernière option
-                        if current_options:
-                            current_options[-1] += " " + option
+                        if self.current_options:
+                            self.current_options[-1] += " " + option
 
                 # Ajuster la bounding box pour inclure la nouvelle option
-                if current_bbox:
-                    current_bbox = (
-                        min(current_bbox[0], bbox[0]),
-                        min(current_bbox[1], bbox[1]),
-                        max(current_bbox[2], bbox[2]),
-                        max(current_bbox[3], bbox[3])
+                if self.current_bbox:
+                    self.current_bbox = (
+                        min(self.current_bbox[0], bbox[0]),
+                        min(self.current_bbox[1], bbox[1]),
+                        max(self.current_bbox[2], bbox[2]),
+                        max(self.current_bbox[3], bbox[3])
                     )
 
             # Ajout des informations spécifiques (par exemple, si c'est une partie d'une question)
-            elif current_question:
-                current_question += " " + block_text
+            elif self.current_question:
+                self.current_question += " " + block_text
+
+    def finish(self):
+        """Sauvegarder la dernière question et renvoyer toutes les questions de la copie."""
+        self.save_question()
+        return self.grouped_questions
+
 
-    save_question()  # Sauvegarder la dernière question après la fin de la boucle
+# Nombre de pages à partir duquel l'extraction d'une copie est répartie sur le pool de processus
+PAGE_PARALLEL_MIN_PAGES = int(os.environ.get('PAGE_PARALLEL_MIN_PAGES', '4'))
 
-    return student_info, grouped_questions
+def extract_pages(doc, page_numbers, template=None):
+    """Blocs de texte imprimés et annotations de l'étudiant pour chaque page demandée.
 
+    Les pages identiques au sujet vierge (template) reprennent ses blocs imprimés et seuls les
+    dessins et textes absents du sujet sont analysés ; les pages scannées sont lues aux
+    emplacements des cases et zones de réponse du sujet. Renvoie aussi, pour chaque page, sa
+    correspondance avec le sujet et le temps passé (en secondes) à extraire le texte et les annotations.
+    """
+    extracted = []
+    timings = {'extract_text': 0.0, 'extract_annotations': 0.0}
+    for page_num in page_numbers:
+        page = doc.load_page(page_num)
+        start = time.perf_counter()
+        text_index = PageTextIndex(page)
+        template_status = None  # 'matched', 'scanned' ou 'unmatched' si un sujet vierge est fourni
+        if not text_index.lines and page.get_images():
+            # Page scannée : sans texte ni tracés, les marques sont lues sur l'image
+            if template is not None and page_num < len(template.pages):
+                template_page = template.pages[page_num]
+                template_status = 'scanned'
+                annotations = extract_scanned_page_annotations(page, page_num, template)
+            else:
+                logger.info(f"Scanned page {page_num} without a registered template: no annotations")
+                template_page = None
+                template_status = 'unmatched' if template is not None else None
+                annotations = []
+        else:
+            template_page = template.match(page_num, text_index) if template else None
+            if template is not None:
+                template_status = 'matched' if template_page else 'unmatched'
+            annotations = extract_page_annotations(page, page_num, template_page, text_index)
+        annotations_done = time.perf_counter()
+        blocks = template_page.blocks if template_page else page.get_text('blocks')
+        timings['extract_annotations'] += annotations_done - start
+        timings['extract_text'] += time.perf_counter() - annotations_done
+        extracted.append((page_num, blocks, annotations, template_status))
+    return extracted, timings
+
+def extract_pdf_pages(pdf_bytes, page_numbers, template=None):
+    """Extraire quelques pages d'un PDF (exécuté dans le pool de processus, qui ouvre son propre document)."""
+    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+    return extract_pages(doc, page_numbers, template)
+
+def extract_sheet(doc, pdf_bytes=None, template=None):
+    """Extraire en un seul parcours des pages les questions imprimées et les annotations de l'étudiant.
+
+    Si le contenu du PDF est fourni, les pages d'une longue copie sont réparties par tranches
+    sur le pool de processus ; les résultats sont ensuite fusionnés dans l'ordre des pages.
+    Si toutes les pages correspondent au sujet vierge (template), les questions sont celles
+    du sujet, regroupées une fois pour toutes à son enregistrement.
+    """
+    student_info = {}
+    page_count = len(doc)
+    workers = cpu_quota()
+
+    if pdf_bytes is not None and workers > 1 and page_count >= PAGE_PARALLEL_MIN_PAGES:
+        chunk_size = math.ceil(page_count / workers)
+        chunks = [range(start, min(start + chunk_size, page_count)) for start in range(0, page_count, chunk_size)]
+        futures = [get_process_pool().submit(extract_pdf_pages, pdf_bytes, chunk, template) for chunk in chunks]
+        pages = []
+        timings = {'extract_text': 0.0, 'extract_annotations': 0.0}
+        for future in futures:
+            chunk_pages, chunk_timings = future.result()
+            pages.extend(chunk_pages)
+            # Temps cumulé des processus du pool (et non durée écoulée)
+            for stage, seconds in chunk_timings.items():
+                timings[stage] += seconds
+    else:
+        pages, timings = extract_pages(doc, range(page_count), template)
+
+    page_annotations = {page_num: annotations for page_num, _, annotations, _ in pages}
+    template_matched = template is not None and page_count == len(template.pages) and all(
+        status in ('matched', 'scanned') for _, _, _, status in pages
+    )
+    if template is not None:
+        observe_template_pages([status for _, _, _, status in pages])
+
+    start = time.perf_counter()
+    if template_matched:
+        grouped_questions = template.grouped_questions
+    else:
+        # Les questions sont regroupées dans l'ordre des pages : une question commencée en bas
+        # d'une page est complétée par les blocs de la page suivante
+        grouper = QuestionGrouper()
+        for page_num, blocks, _, _ in pages:
+            grouper.add_blocks(page_num, blocks)
+        grouped_questions = grouper.finish()
+    timings['extract_text'] += time.perf_counter() - start
+
+    for stage, seconds in timings.items():
+        observe_stage(stage, seconds)
+    observe_sheet(page_count, len(grouped_questions), sum(len(annotations) for annotations in page_annotations.values()))
+
+    return student_info, grouped_questions, page_annotations
+
+class SubstringIndex:
+    """Recherche de la première entrée dont un des textes contient une chaîne donnée.
+
+    Les entrées sont des couples (valeur, textes normalisés) ; find(text) renvoie la valeur de la
+    première entrée (dans l'ordre d'insertion) dont un texte contient text. Les candidates sont
+    présélectionnées par un index de n-grammes.
+    """
+
+    ngram_size = 3
+
+    def __init__(self, entries):
+        self.values = [value for value, _ in entries]
+        self.texts = [texts for _, texts in entries]
+        self.ngrams = {}  # n-gramme -> positions (croissantes) des entrées qui le contiennent
+
+        for position, texts in enumerate(self.texts):
+            for text in texts:
+                for start in range(len(text) - self.ngram_size + 1):
+                    postings = self.ngrams.setdefault(text[start:start + self.ngram_size], [])
+                    if not postings or postings[-1] != position:
+                        postings.append(position)
+
+    def find(self, normalized_text):
+        return next(self._matches(normalized_text), None)
+
+    def find_all(self, normalized_text):
+        """Valeurs de toutes les entrées dont un texte contient normalized_text, dans l'ordre d'insertion."""
+        return list(self._matches(normalized_text))
+
+    def _matches(self, normalized_text):
+        if len(normalized_text) < self.ngram_size:
+            candidates = range(len(self.values))
+        else:
+            candidates = None
+            for start in range(len(normalized_text) - self.ngram_size + 1):
+                postings = self.ngrams.get(normalized_text[start:start + self.ngram_size])
+                if not postings:
+                    return
+                candidates = set(postings) if candidates is None else candidates.intersection(postings)
+                if not candidates:
+                    return
+            candidates = sorted(candidates)
+
+        for position in candidates:
+            if any(normalized_text in text for text in self.texts[position]):
+                yield self.values[position]
+
+
+def matched_option(question, normalized_text):
+    """Option de la question qui contient le texte normalisé de la marque, s'il n'y en a qu'une.
+
+    Un texte vide ou contenu dans plusieurs options (capture tronquée) ne désigne pas d'option :
+    la réponse est alors notée sur le texte capturé.
+    """
+    if not normalized_text:
+        return None
+    options = [option for option in question['options'] if normalized_text in normalize_text(option)]
+    return options[0] if len(options) == 1 else None
+
+def rect_distance(rect_a, rect_b):
+    """Distance entre deux rectangles (0 s'ils se touchent)."""
+    dx = max(rect_b.x0 - rect_a.x1, rect_a.x0 - rect_b.x1, 0)
+    dy = max(rect_b.y0 - rect_a.y1, rect_a.y0 - rect_b.y1, 0)
+    return math.hypot(dx, dy)
+
+def option_question(option_index, normalized_text, page_num, rect):
+    """Question à options d'une marque : parmi celles dont une option contient le texte,
+    la plus proche de la marque sur sa page (la première trouvée s'il n'y en a pas sur la page).
+
+    Une capture tronquée (". fe") est contenue dans les options de plusieurs questions.
+    """
+    if not normalized_text:
+        return None
+    candidates = option_index.find_all(normalized_text)
+    if len(candidates) <= 1:
+        return candidates[0] if candidates else None
+    on_page = [question for question in candidates if question.get('page_num') == page_num]
+    if not on_page:
+        return candidates[0]
+    return min(on_page, key=lambda question: rect_distance(fitz.Rect(question['bbox']), rect))
+
+@timed('association')
 def associate_responses_with_questions(grouped_questions, annotations):
     question_response_mapping = []
+    # Options normalisées de toutes les questions à options (choix multiples, vrai ou faux,
+    # soulignement), indexées une seule fois par copie
+    option_index = SubstringIndex([
+        (question, [normalize_text(option) for option in question['options']])
+        for question in grouped_questions if question['options']
+    ])
+
+    # Réponses soulignées sans option correspondante : associées plus bas, page par page,
+    # à la question ouverte la plus proche. Les entrées de question_response_mapping sont
+    # complétées sur place pour garder l'ordre des annotations.
+    pending_open = {}  # page -> [(entrée, annotation, rectangle)]
 
     for page_num, annotation_list in annotations.items():
         for annotation in annotation_list:
@@ -172,74 +630,56 @@ def associate_responses_with_questions(grouped_questions, annotations):
                 logger.info(f"Unexpected type for annotation rect: {type(annotation.get('rect'))}")
                 continue
 
+            # Marque lue à l'emplacement d'une case ou d'une zone de réponse du sujet vierge : la question est connue
+            template_question = annotation.get('template_question')
+            if template_question is not None:
+                question_response_mapping.append({
+                    'question': template_question['question'],
+                    'response': annotation['text'] if annotation['type'] == 'manual_check' else annotation['text_above'],
+                    'page_num': page_num,
+                    'question_rect': rect_to_dict(fitz.Rect(template_question['bbox'])),
+                    'type': template_question['type'],
+                    'option': annotation.get('option')
+                })
+                continue
+
             response_text = annotation.get('text_above', '').strip()
             found_question = None
+            found_option = None  # Option imprimée correspondant à la marque (questions à options)
             question_rect_final = None  # Initialisation de question_rect_final
            
             # Gestion des annotations de type 'manual_check' (cases cochées)
             if annotation['type'] == 'manual_check':
                 if len(annotation['text']) > 0:
-                    for question in grouped_questions:
-                        if question['type'] == 'multiple_choice':
-                            question_rect = fitz.Rect(question['bbox'])
-                            # Vérifier si la question est proche de l'annotation
-                            for option in question['options']:
-                                if normalize_text(annotation['text']) in normalize_text(option):
-                                    found_question = question
-                                    question_rect_final = question_rect
-                                    break
-                        if found_question:
-                            break
+                    normalized_check_text = normalize_text(annotation['text'])
+                    found_question = option_question(option_index, normalized_check_text, page_num, annotation_rect)
+                    if found_question:
+                        question_rect_final = fitz.Rect(found_question['bbox'])
+                        found_option = matched_option(found_question, normalized_check_text)
 
             # Gestion des annotations de type 'manual_line'
             elif annotation['type'] == 'manual_line':
                 normalized_response_text = normalize_text(response_text)
                 if len(response_text) > 0:
-                    # Chercher une correspondance avec une question à choix multiples
-                    for question in grouped_questions:
-                        if question['type'] == 'multiple_choice':
-                            question_rect = fitz.Rect(question['bbox'])
-                            for option in question['options']:
-                                if normalized_response_text in normalize_text(option):
-                                    found_question = question
-                                    question_rect_final = question_rect
-                                    break
-                        if found_question:
-                            break
+                    # Chercher une correspondance avec une question à options
+                    found_question = option_question(option_index, normalized_response_text, page_num, annotation_rect)
+                    if found_question:
+                        question_rect_final = fitz.Rect(found_question['bbox'])
+                        found_option = matched_option(found_question, normalized_response_text)
 
                     # Si aucune correspondance n'est trouvée, chercher une question ouverte
                     if not found_question:
-                        # Avant de calculer la distance, vérifier les coordonnées de chaque centre
-                        annotation_rect = fitz.Rect(annotation['rect'])
-                        annotation_center = get_center(annotation_rect)
-
-                        if annotation_center is None:
-                            logger.info(f"Invalid annotation rectangle for annotation on page {page_num}: {annotation}")
-                            continue  # Passer à l'annotation suivante
-
-                        max_distance = 100
-                        min_distance = float('inf')
-
-                        for question in grouped_questions:
-                            if question['type'] == 'open_ended' and question['page_num'] == annotation['page_num']:
-                                question_rect = fitz.Rect(question['bbox'])
-                                question_center = get_center(question_rect)
-
-                                if question_center is None:
-                                    logger.info(f"Invalid question rectangle for question on page {question['page_num']}: {question}")
-                                    continue  # Passer à la question suivante
-
-                                distance = euclidean_distance(annotation_center, question_center)
-
-                                if distance < min_distance and distance <= max_distance:
-                                    min_distance = distance
-                                    found_question = question
-                                    question_rect_final = question_rect
-                                elif question_rect.y1 < annotation_rect.y0:
-                                    if question_rect.y1 > max_y:
-                                        max_y = question_rect.y1
-                                        found_question = question
-                                        question_rect_final = question_rect
+                        entry = {
+                            'question': None,
+                            'response': response_text,
+                            'page_num': page_num,
+                            'question_rect': None,
+                            'type': None,
+                            'option': None
+                        }
+                        question_response_mapping.append(entry)
+                        pending_open.setdefault(annotation['page_num'], []).append((entry, annotation, fitz.Rect(annotation_rect)))
+                        continue
             
             # Ajouter la correspondance question-réponse uniquement si une question et son rectangle sont trouvés
             if found_question and question_rect_final:
@@ -247,192 +687,454 @@ def associate_responses_with_questions(grouped_questions, annotations):
                     'question': found_question['question'],
                     'response': response_text if annotation['type'] != 'manual_check' else annotation['text'],
                     'page_num': page_num,
-                    'question_rect': rect_to_dict(question_rect_final)
+                    'question_rect': rect_to_dict(question_rect_final),
+                    'type': found_question['type'],
+                    'option': found_option
                 })
             else:
-                logger.info(f"No matching question found for annotation on page {page_num}: {annotation}")
+                logger.debug("No matching question found for annotation on page %s: %s", page_num, annotation)
+
+    if pending_open:
+        open_questions = open_questions_by_page(grouped_questions)
+        for page_num, pending in pending_open.items():
+            questions, question_boxes = open_questions.get(page_num, ([], np.empty((0, 4))))
+            annotation_boxes = np.array([tuple(rect) for _, _, rect in pending], dtype=float)
+            for (entry, annotation, _), question_position in zip(pending, nearest_open_questions(question_boxes, annotation_boxes)):
+                if question_position < 0:
+                    logger.debug("No matching question found for annotation on page %s: %s", page_num, annotation)
+                    continue
+                question = questions[question_position]
+                entry['question'] = question['question']
+                entry['question_rect'] = rect_to_dict(fitz.Rect(question['bbox']))
+                entry['type'] = question['type']
+        question_response_mapping = [entry for entry in question_response_mapping if entry['question'] is not None]
 
     return question_response_mapping
 
 
-def get_center(rect):
-    if rect is None:
-        return None
-    # Vérifier que les coordonnées sont valides avant de calculer le centre
-    if rect.x0 == rect.x1 or rect.y0 == rect.y1:  # Vérifier que la largeur et la hauteur sont valides
-        return None
-    return ((rect.x0 + rect.x1) / 2, (rect.y0 + rect.y1) / 2)
+# Distance maximale (en points) entre les centres d'une réponse soulignée et de sa question ouverte
+OPEN_QUESTION_MAX_DISTANCE = 100
 
-def euclidean_distance(center1, center2):
-    if center1 is None or center2 is None:
-        return float('inf')  # Retourner une grande valeur si l'une des coordonnées est invalide
-    return ((center1[0] - center2[0]) ** 2 + (center1[1] - center2[1]) ** 2) ** 0.5
+def open_questions_by_page(grouped_questions):
+    """Questions ouvertes de chaque page et leurs boîtes englobantes (tableau N x 4)."""
+    questions_by_page = {}
+    for question in grouped_questions:
+        if question['type'] == 'open_ended':
+            questions_by_page.setdefault(question['page_num'], []).append(question)
+    return {
+        page_num: (questions, np.array([question['bbox'] for question in questions], dtype=float))
+        for page_num, questions in questions_by_page.items()
+    }
 
+def nearest_open_questions(question_boxes, annotation_boxes, max_distance=OPEN_QUESTION_MAX_DISTANCE):
+    """Position de la question ouverte associée à chaque annotation d'une page (-1 si aucune).
 
-def extract_annotations(doc):
-    page_annotations = {}
-    # Liste des symboles cochés à rechercher
-    symbols_to_check = ["x","X", "✓"]
+    La question retenue est celle dont le centre est le plus proche du centre de l'annotation,
+    à max_distance points au plus ; à défaut, la plus basse des questions situées entièrement
+    au-dessus de l'annotation. À égalité, la première question de la page est retenue.
+    Les rectangles vides (largeur ou hauteur nulle) sont ignorés.
+    """
+    associated = np.full(len(annotation_boxes), -1)
+    if len(question_boxes) == 0 or len(annotation_boxes) == 0:
+        return associated
 
-    for page_num in range(len(doc)):
-        page = doc.load_page(page_num)
-        annotations = []
+    valid_questions = (question_boxes[:, 0] != question_boxes[:, 2]) & (question_boxes[:, 1] != question_boxes[:, 3])
+    valid_annotations = (annotation_boxes[:, 0] != annotation_boxes[:, 2]) & (annotation_boxes[:, 1] != annotation_boxes[:, 3])
 
-        # Détecter les dessins manuels (rectangles, lignes et cercles)
-        drawings = page.get_drawings()
-        for drawing in drawings:
-            for item in drawing['items']:
-                try:
-                    # Détection des rectangles (encadrements manuels)
-                    if item[0] == 're':  # Détection des rectangles manuels
-                        if isinstance(item[1], (tuple, list)) and len(item[1]) == 4:
-                            rect_info = {
-                                "type": "manual_box",  # Encadrement manuel détecté
-                                "rect": fitz.Rect(item[1]),  # Convertir item[1] en objet Rect valide
-                                "page_num": page_num,
-                            }
+    # Distances entre centres : une ligne par annotation, une colonne par question
+    question_centers = (question_boxes[:, :2] + question_boxes[:, 2:]) / 2
+    annotation_centers = (annotation_boxes[:, :2] + annotation_boxes[:, 2:]) / 2
+    offsets = annotation_centers[:, None, :] - question_centers[None, :, :]
+    distances = np.hypot(offsets[..., 0], offsets[..., 1])
+    distances[:, ~valid_questions] = np.inf
+
+    nearest = distances.argmin(axis=1)  # argmin renvoie la première position en cas d'égalité
+    within = distances[np.arange(len(annotation_boxes)), nearest] <= max_distance
+
+    # Bas des questions entièrement au-dessus de l'annotation (y croissant vers le bas)
+    above = (question_boxes[None, :, 3] < annotation_boxes[:, None, 1]) & valid_questions[None, :]
+    bottoms = np.where(above, question_boxes[None, :, 3], -np.inf)
+    lowest_above = bottoms.argmax(axis=1)
+
+    associated = np.where(within, nearest, np.where(above.any(axis=1), lowest_above, -1))
+    associated[~valid_annotations] = -1
+    return associated
 
-                            # Extraire le texte à l'intérieur du rectangle
-                            text_inside = page.get_text("text", clip=rect_info["rect"])
-                            if clean_text(text_inside):
-                                rect_info["content"] = clean_text(text_inside)
 
-                            # Ajouter à la liste des annotations
-                            annotations.append(rect_info)
 
-                    # Détection des ellipses (encadrements circulaires manuels)
-                    elif item[0] == 'el':  # Détection des ellipses ou cercles
-                        ellipse_rect = fitz.Rect(item[1])  # Extraire la boîte englobante de l'ellipse
-                        ellipse_info = {
-                            "type": "manual_ellipse",  # Encadrement circulaire détecté
-                            "rect": ellipse_rect,
+def extract_page_annotations(page, page_num, template_page=None, text_index=None):
+    """Détecter les marques de l'étudiant (dessins et symboles cochés) sur une page.
+
+    Si la page correspond au sujet vierge (template_page), les dessins et textes imprimés du
+    sujet sont ignorés : seules les marques ajoutées par l'étudiant sont analysées.
+    """
+    # Liste des symboles cochés à rechercher
+    symbols_to_check = ["x","X", "✓"]
+
+    if text_index is None:
+        text_index = PageTextIndex(page)
+    annotations = []
+
+    # Détecter les dessins manuels (rectangles, lignes et cercles)
+    drawings = page.get_drawings()
+    for drawing in drawings:
+        for item in drawing['items']:
+            # Tracés du sujet vierge (cadres, cases d'options, filets) : pas une marque de l'étudiant
+            if template_page and drawing_fingerprint(item) in template_page.drawings:
+                continue
+            try:
+                # Détection des rectangles (encadrements manuels)
+                if item[0] == 're':  # Détection des rectangles manuels
+                    if isinstance(item[1], (tuple, list)) and len(item[1]) == 4:
+                        rect_info = {
+                            "type": "manual_box",  # Encadrement manuel détecté
+                            "rect": fitz.Rect(item[1]),  # Convertir item[1] en objet Rect valide
                             "page_num": page_num,
                         }
 
-                        # Extraire le texte à l'intérieur de l'ellipse
-                        text_inside = page.get_text("text", clip=ellipse_info["rect"])
+                        # Extraire le texte à l'intérieur du rectangle
+                        text_inside = text_index.get_text(rect_info["rect"])
                         if clean_text(text_inside):
-                            ellipse_info["content"] = clean_text(text_inside)
+                            rect_info["content"] = clean_text(text_inside)
 
                         # Ajouter à la liste des annotations
-                        annotations.append(ellipse_info)
-
-                    elif item[0] == 'l':  # Détection des lignes (soulignements manuels)
-                        from_point = item[1]
-                        to_point = item[2]
-
-                        if isinstance(from_point, fitz.Point) and isinstance(to_point, fitz.Point):
-                            padding = 5  # Augmenter le padding pour capturer plus de texte
-                            # Créer un rectangle autour de la ligne
-                            rect_from = fitz.Rect(min(from_point.x, to_point.x) - padding,
-                                                  min(from_point.y, to_point.y) - padding,
-                                                  max(from_point.x, to_point.x) + padding,
-                                                  max(from_point.y, to_point.y) + padding)
-
-                            # Extraire le texte au-dessus de la ligne
-                            text_above_line = page.get_text("text", clip=rect_from)
-
-                            if clean_text(text_above_line):
-                                line_info = {
-                                    "type": "manual_line",  # Ligne manuelle
-                                    "from": from_point,
-                                    "to": to_point,
-                                    "page_num": page_num,
-                                    "rect": rect_from,  # Ajouter un champ rect
-                                    "text_above": clean_text(text_above_line),
-                                    "subtype": "manual_underline"  # Soulignement manuel
-                                }
-                                annotations.append(line_info)
-                            else:
-                                logger.info(f"Pas de texte détecté autour de la ligne à la page {page_num}.")
+                        annotations.append(rect_info)
+
+                # Détection des ellipses (encadrements circulaires manuels)
+                elif item[0] == 'el':  # Détection des ellipses ou cercles
+                    ellipse_rect = fitz.Rect(item[1])  # Extraire la boîte englobante de l'ellipse
+                    ellipse_info = {
+                        "type": "manual_ellipse",  # Encadrement circulaire détecté
+                        "rect": ellipse_rect,
+                        "page_num": page_num,
+                    }
+
+                    # Extraire le texte à l'intérieur de l'ellipse
+                    text_inside = text_index.get_text(ellipse_info["rect"])
+                    if clean_text(text_inside):
+                        ellipse_info["content"] = clean_text(text_inside)
+
+                    # Ajouter à la liste des annotations
+                    annotations.append(ellipse_info)
+
+                elif item[0] == 'l':  # Détection des lignes (soulignements manuels)
+                    from_point = item[1]
+                    to_point = item[2]
+
+                    if isinstance(from_point, fitz.Point) and isinstance(to_point, fitz.Point):
+                        padding = 5  # Augmenter le padding pour capturer plus de texte
+                        # Créer un rectangle autour de la ligne
+                        rect_from = fitz.Rect(min(from_point.x, to_point.x) - padding,
+                                              min(from_point.y, to_point.y) - padding,
+                                              max(from_point.x, to_point.x) + padding,
+                                              max(from_point.y, to_point.y) + padding)
+
+                        # Extraire le texte au-dessus de la ligne
+                        text_above_line = text_index.get_text(rect_from)
+
+                        if clean_text(text_above_line):
+                            line_info = {
+                                "type": "manual_line",  # Ligne manuelle
+                                "from": from_point,
+                                "to": to_point,
+                                "page_num": page_num,
+                                "rect": rect_from,  # Ajouter un champ rect
+                                "text_above": clean_text(text_above_line),
+                                "subtype": "manual_underline"  # Soulignement manuel
+                            }
+                            annotations.append(line_info)
                         else:
-                            logger.info(f"Points invalides détectés : from_point={from_point}, to_point={to_point}")
+                            logger.debug("Pas de texte détecté autour de la ligne à la page %s.", page_num)
+                    else:
+                        logger.debug("Points invalides détectés : from_point=%s, to_point=%s", from_point, to_point)
 
-                except Exception as e:
-                    logger.info(f"Erreur rencontrée lors du traitement de l'élément : {item}, Erreur : {e}")
+            except Exception as e:
+                logger.debug("Erreur rencontrée lors du traitement de l'élément : %s, Erreur : %s", item, e)
 
-        # Détection du texte manuscrit
-        text_blocks = page.get_text("dict")["blocks"]  # Capturer tout le texte sous forme de dictionnaire
+    # Détection du texte manuscrit
+    text_blocks = text_index.blocks  # Texte de la page déjà extrait par l'index
 
-        # Liste des caractères ou symboles représentant de nouvelles options de réponse (par ex. "❍", "•", etc.)
-        stop_symbols = ["❍", "◯", "❑", "⬜"]
+    # Liste des caractères ou symboles représentant de nouvelles options de réponse (par ex. "❍", "•", etc.)
+    stop_symbols = ["❍", "◯", "❑", "⬜"]
 
-        for block in text_blocks:
-            if block["type"] == 0:  # Type 0 = texte imprimé normal
-                for line in block["lines"]:
-                    for span in line["spans"]:
-                        text = clean_text(span["text"])
+    for block in text_blocks:
+        if block["type"] == 0:  # Type 0 = texte imprimé normal
+            for line in block["lines"]:
+                for span in line["spans"]:
+                    # Texte imprimé du sujet vierge
+                    if template_page and span.get("template"):
+                        continue
+                    text = clean_text(span["text"])
+                    
+                    # Rechercher les symboles cochés "X" ou "✓"
+                    if any(symbol in text for symbol in symbols_to_check):
+                        # Extraire le symbole détecté
+                        detected_symbol = [symbol for symbol in symbols_to_check if symbol in text][0]
                         
-                        # Rechercher les symboles cochés "X" ou "✓"
-                        if any(symbol in text for symbol in symbols_to_check):
-                            # Extraire le symbole détecté
-                            detected_symbol = [symbol for symbol in symbols_to_check if symbol in text][0]
-                            
-                            # Si le symbole détecté est 'x'
-                            if text == 'x':
-                                # Initialiser symbol_info avec les informations disponibles
-                                symbol_info = {
-                                    "type": "manual_check",
-                                    "symbol": detected_symbol,
-                                    "text_symbol": text,  # Le texte contenant le symbole
-                                    "rect": fitz.Rect(span["bbox"]),  # Coordonnées de la zone du texte
-                                    "page_num": page.number
-                                }
-
-                                # Initialiser le texte complet capturé à droite du symbole
-                                full_text = ""
-                                capture_increment = 30  # Largeur de capture pour chaque segment
-                                current_x = symbol_info["rect"][2]  # Coordonnée x1 (droite du symbole "x")
-                                y0, y1 = symbol_info["rect"][1] + 5, symbol_info["rect"][3] - 5  # Limiter la hauteur de capture
-                                max_capture_width = 500  # Largeur maximale à parcourir à droite
-
-                                # Boucle pour capturer le texte à droite du symbole
-                                while current_x < symbol_info["rect"][2] + max_capture_width:
-                                    # Définir une nouvelle zone de capture pour chaque segment
-                                    text_to_right_rect = fitz.Rect(
-                                        current_x,  # Coordonnée x1 (droite de la zone précédente)
-                                        y0,  # y0 (limite supérieure)
-                                        current_x + capture_increment,  # Étendre légèrement à droite
-                                        y1  # y1 (limite inférieure)
-                                    )
-                                    
-                                    # Extraire le texte dans cette petite zone
-                                    text_to_right = clean_text(page.get_text("text", clip=text_to_right_rect))
-                                    
-                                    # Arrêter la capture si un symbole d'option est détecté
-                                    if any(stop_symbol in text_to_right for stop_symbol in stop_symbols):
-                                        break  # Arrêter la capture si une nouvelle option est détectée
-
-                                    # Ajouter le texte capturé au texte complet
-                                    full_text += text_to_right
-                                    
-                                    # Passer à la prochaine section de capture
-                                    current_x += capture_increment
-
-                                # Correction des mots coupés à la fin
-                                if full_text.endswith(" "):
-                                    # Si le texte se termine par un espace, il est possible que le mot soit coupé
-                                    extended_capture_rect = fitz.Rect(
-                                        current_x,  # Continuer la capture à droite
-                                        y0,  # y0 (limite supérieure)
-                                        current_x + capture_increment,  # Capturer une petite section supplémentaire
-                                        y1  # y1 (limite inférieure)
-                                    )
-                                    additional_text = clean_text(page.get_text("text", clip=extended_capture_rect))
-                                    full_text += additional_text  # Ajouter le texte supplémentaire si nécessaire
+                        # Si le symbole détecté est 'x'
+                        if text == 'x':
+                            # Initialiser symbol_info avec les informations disponibles
+                            symbol_info = {
+                                "type": "manual_check",
+                                "symbol": detected_symbol,
+                                "text_symbol": text,  # Le texte contenant le symbole
+                                "rect": fitz.Rect(span["bbox"]),  # Coordonnées de la zone du texte
+                                "page_num": page.number
+                            }
+
+                            # Initialiser le texte complet capturé à droite du symbole
+                            full_text = ""
+                            capture_increment = 30  # Largeur de capture pour chaque segment
+                            current_x = symbol_info["rect"][2]  # Coordonnée x1 (droite du symbole "x")
+                            y0, y1 = symbol_info["rect"][1] + 5, symbol_info["rect"][3] - 5  # Limiter la hauteur de capture
+                            max_capture_width = 500  # Largeur maximale à parcourir à droite
+
+                            # Boucle pour capturer le texte à droite du symbole
+                            while current_x < symbol_info["rect"][2] + max_capture_width:
+                                # Définir une nouvelle zone de capture pour chaque segment
+                                text_to_right_rect = fitz.Rect(
+                                    current_x,  # Coordonnée x1 (droite de la zone précédente)
+                                    y0,  # y0 (limite supérieure)
+                                    current_x + capture_increment,  # Étendre légèrement à droite
+                                    y1  # y1 (limite inférieure)
+                                )
                                 
-                                # Nettoyer les répétitions de caractères (comme "dd" ou "oo")
-                                def remove_repetitions(text):
-                                    return re.sub(r'(.)\1+', r'\1', text)
+                                # Extraire le texte dans cette petite zone
+                                text_to_right = clean_text(text_index.get_text(text_to_right_rect))
                                 
-                                # Nettoyer le texte final capturé
-                                symbol_info["text"] = remove_repetitions(clean_text(full_text))
-                                # Ajouter l'annotation avec le texte complet
-                                annotations.append(symbol_info)
-
-        page_annotations[page_num] = annotations
+                                # Arrêter la capture si un symbole d'option est détecté
+                                if any(stop_symbol in text_to_right for stop_symbol in stop_symbols):
+                                    break  # Arrêter la capture si une nouvelle option est détectée
 
-    return page_annotations
+                                # Ajouter le texte capturé au texte complet
+                                full_text += text_to_right
+                                
+                                # Passer à la prochaine section de capture
+                                current_x += capture_increment
+
+                            # Correction des mots coupés à la fin
+                            if full_text.endswith(" "):
+                                # Si le texte se termine par un espace, il est possible que le mot soit coupé
+                                extended_capture_rect = fitz.Rect(
+                                    current_x,  # Continuer la capture à droite
+                                    y0,  # y0 (limite supérieure)
+                                    current_x + capture_increment,  # Capturer une petite section supplémentaire
+                                    y1  # y1 (limite inférieure)
+                                )
+                                additional_text = clean_text(text_index.get_text(extended_capture_rect))
+                                full_text += additional_text  # Ajouter le texte supplémentaire si nécessaire
+                            
+                            # Nettoyer les répétitions de caractères (comme "dd" ou "oo")
+                            def remove_repetitions(text):
+                                return re.sub(r'(.)\1+', r'\1', text)
+                            
+                            # Nettoyer le texte final capturé
+                            symbol_info["text"] = remove_repetitions(clean_text(full_text))
+                            # Ajouter l'annotation avec le texte complet
+                            annotations.append(symbol_info)
+
+    return annotations
+
+def drawing_fingerprint(item):
+    """Empreinte d'un élément de tracé (page.get_drawings()) : type et coordonnées arrondies."""
+    coordinates = []
+    for value in item[1:]:
+        if isinstance(value, fitz.Quad):
+            value = [coordinate for point in value for coordinate in point]
+        if isinstance(value, (int, float)):
+            coordinates.append(round(value, 1))
+        else:
+            coordinates.extend(round(coordinate, 1) for coordinate in value)
+    return (item[0], tuple(coordinates))
+
+def span_fingerprint(span):
+    """Empreinte d'un span de texte : texte et origine arrondie."""
+    x, y = span["origin"]
+    return (span["text"], round(x, 1), round(y, 1))
+
+# Symboles des cases d'options imprimées
+OPTION_SYMBOLS = "❍◯❑⬜"
+
+class TemplatePage:
+    """Tracés, textes et blocs imprimés d'une page du sujet vierge.
+
+    Les cases d'options (bubbles) et les zones de réponse des questions ouvertes (open_regions)
+    sont associées à leur question par SheetTemplate.
+    """
+
+    def __init__(self, page):
+        text_index = PageTextIndex(page)
+        self.rect = tuple(page.rect)
+        self.spans = {span_fingerprint(span) for span in text_index.spans()}
+        self.drawings = {drawing_fingerprint(item) for drawing in page.get_drawings() for item in drawing['items']}
+        self.blocks = page.get_text('blocks')
+
+        # Cases d'options : boîte du symbole et texte de l'option, jusqu'à la case suivante de la ligne
+        self.options = []
+        for _, _, _, _, _, chars in text_index.lines:
+            option = None
+            for bbox, c, _, _ in chars:
+                if c in OPTION_SYMBOLS:
+                    option = [bbox, c]
+                    self.options.append(option)
+                elif option is not None:
+                    option[1] += c
+        self.bubbles = []  # (boîte de la case, texte de l'option, index de la question)
+        self.bubble_rects = np.empty((0, 4))
+        self.open_regions = []  # (zone de réponse, index de la question)
+        self.region_rects = np.empty((0, 4))
+
+class SheetTemplate:
+    """Sujet vierge d'un examen, analysé une seule fois à son enregistrement.
+
+    Une page de copie correspond à la page du sujet si tous les textes imprimés du sujet s'y
+    retrouvent à la même position. Les marques de l'étudiant sont alors cherchées parmi les
+    seuls tracés et textes absents du sujet. Les pages scannées sont lues aux emplacements des
+    cases et zones de réponse du sujet (extract_scanned_page_annotations).
+    """
+
+    # Marges (en points) des zones de réponse des questions ouvertes
+    region_margin = 20
+
+    def __init__(self, pdf_bytes):
+        doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+        self.pdf_bytes = pdf_bytes
+        self.version = hashlib.sha256(pdf_bytes).hexdigest()[:16]
+        self.pages = [TemplatePage(doc.load_page(page_num)) for page_num in range(len(doc))]
+
+        grouper = QuestionGrouper()
+        for page_num, template_page in enumerate(self.pages):
+            grouper.add_blocks(page_num, template_page.blocks)
+        self.grouped_questions = grouper.finish()
+
+        for page_num, template_page in enumerate(self.pages):
+            page_questions = [
+                (index, question) for index, question in enumerate(self.grouped_questions)
+                if question['page_num'] == page_num and question['bbox']
+            ]
+            # Case rattachée à la première question à options dont la boîte contient son centre
+            for bbox, option in template_page.options:
+                center_x, center_y = (bbox[0] + bbox[2]) / 2, (bbox[1] + bbox[3]) / 2
+                for index, question in page_questions:
+                    x0, y0, x1, y1 = question['bbox']
+                    if question['options'] and x0 <= center_x <= x1 and y0 <= center_y <= y1:
+                        option = matched_option(question, normalize_text(option)) or option.strip()
+                        template_page.bubbles.append((bbox, option, index))
+                        break
+            # Zone de réponse d'une question ouverte : sous l'énoncé, jusqu'à la question suivante
+            page_width, page_height = template_page.rect[2], template_page.rect[3]
+            for index, question in page_questions:
+                if question['type'] != 'open_ended':
+                    continue
+                top = question['bbox'][3]
+                bottom = min(
+                    [other['bbox'][1] for _, other in page_questions if other['bbox'][1] > top],
+                    default=page_height - self.region_margin,
+                )
+                if bottom > top:
+                    region = (self.region_margin, top, page_width - self.region_margin, bottom)
+                    template_page.open_regions.append((region, index))
+            if template_page.bubbles:
+                template_page.bubble_rects = np.array([bbox for bbox, _, _ in template_page.bubbles], dtype=float)
+            if template_page.open_regions:
+                template_page.region_rects = np.array([region for region, _ in template_page.open_regions], dtype=float)
+
+    def match(self, page_num, text_index):
+        """Page du sujet correspondant à la page de copie (indexée par text_index), ou None.
+
+        Les spans de la copie imprimés sur le sujet sont marqués ("template").
+        """
+        if page_num >= len(self.pages):
+            return None
+        template_page = self.pages[page_num]
+        found = set()
+        for span in text_index.spans():
+            fingerprint = span_fingerprint(span)
+            if fingerprint in template_page.spans:
+                span["template"] = True
+                found.add(fingerprint)
+        return template_page if len(found) == len(template_page.spans) else None
+
+    def printed_mask(self, page_num, dpi):
+        """Encre imprimée d'une page du sujet, rendue à la résolution de la page scannée."""
+        # Le sujet est copié dans le processus d'analyse à chaque copie : cache propre au processus
+        key = (self.version, page_num, dpi)
+        with _printed_masks_lock:
+            if key in _printed_masks:
+                _printed_masks.move_to_end(key)
+                return _printed_masks[key]
+        doc = fitz.open(stream=self.pdf_bytes, filetype="pdf")
+        mask = omr.printed_mask(omr.render_gray(doc.load_page(page_num), dpi), dpi)
+        with _printed_masks_lock:
+            _printed_masks[key] = mask
+            while len(_printed_masks) > PRINTED_MASKS_CACHE_SIZE:
+                _printed_masks.popitem(last=False)
+        return mask
+
+# Masques de l'encre imprimée des sujets (version, page, dpi), environ 2 Mo par page A4 à 150 dpi
+PRINTED_MASKS_CACHE_SIZE = 32
+_printed_masks = OrderedDict()
+_printed_masks_lock = threading.Lock()
+
+# Lecture des copies scannées : part minimale d'encre absente du sujet vierge pour qu'une case soit
+# cochée ou qu'une zone de réponse soit lue, et langue de Tesseract
+OMR_FILL_THRESHOLD = float(os.environ.get('OMR_FILL_THRESHOLD', '0.05'))
+OMR_INK_THRESHOLD = float(os.environ.get('OMR_INK_THRESHOLD', '0.002'))
+OMR_OCR_LANG = os.environ.get('OMR_OCR_LANG', 'fra')
+
+def extract_scanned_page_annotations(page, page_num, template):
+    """Marques d'une page scannée, lues aux emplacements des cases et zones de réponse du sujet vierge.
+
+    La page est rendue une seule fois, à la résolution juste suffisante pour les cases (et pour
+    Tesseract si la page a des questions ouvertes). Le scan doit couvrir la page comme le sujet.
+    """
+    template_page = template.pages[page_num]
+    bubble_heights = template_page.bubble_rects[:, 3] - template_page.bubble_rects[:, 1]
+    dpi = omr.page_dpi(page, bubble_heights.min() if len(bubble_heights) else None, bool(template_page.open_regions))
+    gray = omr.render_gray(page, dpi)
+    integral = omr.new_ink_integral(gray, template.printed_mask(page_num, dpi), dpi)
+
+    annotations = []
+    # Pour chaque question, la case la plus remplie
+    fills = omr.fill_ratios(integral, template_page.bubble_rects, dpi)
+    answered_questions = set()
+    for bubble_index in np.argsort(-fills, kind='stable'):
+        if fills[bubble_index] < OMR_FILL_THRESHOLD:
+            break
+        bbox, option, question_index = template_page.bubbles[bubble_index]
+        if question_index in answered_questions:
+            continue
+        answered_questions.add(question_index)
+        annotations.append({
+            "type": "manual_check",
+            "symbol": "omr",
+            "rect": fitz.Rect(bbox),
+            "page_num": page_num,
+            "text": option,
+            "option": option,
+            "fill": float(fills[bubble_index]),
+            "template_question": template.grouped_questions[question_index],
+        })
+
+    # Zones de réponse encrées : seules celles-ci sont lues par Tesseract
+    ink = omr.fill_ratios(integral, template_page.region_rects, dpi)
+    written = [position for position in np.flatnonzero(ink >= OMR_INK_THRESHOLD)]
+    texts = omr.ocr_images(
+        [omr.crop(gray, template_page.open_regions[position][0], dpi) for position in written],
+        OMR_OCR_LANG, cpu_quota(),
+    )
+    for position, text in zip(written, texts):
+        region, question_index = template_page.open_regions[position]
+        if clean_text(text):
+            annotations.append({
+                "type": "manual_line",
+                "rect": fitz.Rect(region),
+                "page_num": page_num,
+                "text_above": clean_text(text),
+                "subtype": "ocr",
+                "template_question": template.grouped_questions[question_index],
+            })
+    return annotations
 
 def separate_question_options(item):
     # Vérifiez que l'item est un dictionnaire contenant une clé 'question'
@@ -454,96 +1156,725 @@ def separate_question_options(item):
     else:
         logger.info("Erreur : format invalide ou clé 'question' manquante dans l'item")
         return None
-def compare_responses(annotated, correct_answers):
-    results = []
-    for annotated_data in annotated:
-        correct_answer = None
-        normalize_annotated_question = normalize_text(annotated_data['question'])
-        
-        # Trouver la réponse correcte pour la question
-        #correct_answer = next((ans['answer'] for ans in correct_answers if normalize_question(ans['question']) == normalize_text(question)), None)
-        for correct_data in correct_answers:
-            separate_correct_question = separate_question_options(correct_data)
-            normalize_separated_correct_question = normalize_text(separate_correct_question['question'])
-           
-            if(normalize_annotated_question in normalize_separated_correct_question):
-                
-                correct_answer = correct_data['answer']
-               
-                user_response = annotated_data['response']
-               
-                if correct_answer:
-                    # Utiliser la similarité cosinus pour comparer les réponses
-                    user_encoded = encode_text(user_response)
-                    correct_encoded = encode_text(correct_answer)
-                    similarity = util.pytorch_cos_sim(user_encoded, correct_encoded).item()
-
-                    # Si la similarité est élevée, on considère que la réponse est correcte
-                    is_correct = similarity > 0.7  # Vous pouvez ajuster le seuil
-                    rect = annotated_data['question_rect']
-                    
-                    results.append({
-                        'question': correct_data['question'],
-                        'user_response': user_response,
-                        'correct_answer': correct_answer,
-                        'is_correct': is_correct,
-                        'similarity': similarity,
-                        'points': correct_data['points'] if is_correct else 0,
-                        'question_rect': rect,
-                    })
-                else: 
-                    results.append({
-                        'question': correct_data['question'],
-                        'user_response': user_response,
-                        'correct_answer': None,
-                        'is_correct': False,
-                        'similarity': 0.0,
-                        'points': 0,
-                        'question_rect': rect,
-                    })
-
-                break
-    return results
+class AnswerKey:
+    """Corrigé compilé : réponses nettoyées, questions normalisées indexées et, si demandé,
+    embeddings des réponses correctes calculés une fois pour toutes les corrections."""
+
+    def __init__(self, cleaned_correct_answers, with_embeddings=False):
+        self.answers = cleaned_correct_answers
+        self.version = None  # Version du corrigé enregistré (None pour un corrigé envoyé avec la requête)
+        # Empreinte du contenu, identique qu'il soit enregistré ou envoyé avec la requête
+        self.fingerprint = hashlib.sha256(json.dumps(cleaned_correct_answers, sort_keys=True).encode('utf-8')).hexdigest()
+        self.questions = [separate_question_options(correct_data) for correct_data in cleaned_correct_answers]
+        self.question_index = SubstringIndex([
+            (index, [normalize_text(separated['question'])]) for index, separated in enumerate(self.questions)
+        ])
+
+        # Embeddings des réponses correctes non vides : index de la réponse -> ligne du tenseur
+        self.embedding_rows = {}
+        self.answer_embeddings = None
+        if with_embeddings:
+            answer_indexes = [index for index, correct_data in enumerate(self.answers) if correct_data['answer']]
+            if answer_indexes:
+                self.embedding_rows = {index: row for row, index in enumerate(answer_indexes)}
+                self.answer_embeddings = encode_text([self.answers[index]['answer'] for index in answer_indexes])
+
+    def find(self, annotated_question):
+        """Index de la première réponse dont la question contient la question annotée."""
+        return self.question_index.find(normalize_text(annotated_question))
+
+# Stratégie de notation selon le type de question : les réponses à options sont comparées
+# directement, le modèle n'est utilisé que pour les réponses rédigées
+GRADING_STRATEGIES = {
+    'multiple_choice': 'option',
+    'true_false': 'option',
+    'highlight_the_correct_answer': 'option',
+    'fill_in_the_blank': 'embedding',
+    'open_ended': 'embedding',
+}
+
+# Préfixe d'option ("❍a.", "b)", ...) ou ce qu'il en reste après la capture à droite de la coche (".")
+OPTION_LABEL = re.compile(r'^[❍◯❑⬜]?\s*(?:[A-Da-d]\s*[.)]|[.)])\s*')
+
+def grading_strategy(question_type):
+    return GRADING_STRATEGIES.get(question_type, 'embedding')
+
+# Symbole de coche isolé, repris dans le texte de l'option quand il est tracé par-dessus
+CHECK_SYMBOL = re.compile(r'(?<!\S)[xX✓](?!\S)')
+
+def option_text(text):
+    """Texte d'une option sans son préfixe, normalisé comme le texte capturé à droite d'une coche."""
+    text = CHECK_SYMBOL.sub(' ', text)
+    text = normalize_text(OPTION_LABEL.sub('', text.strip()))
+    # La capture des coches supprime les lettres répétées : faire de même des deux côtés
+    return re.sub(r'(.)\1+', r'\1', text)
+
+def option_similarity(user_response, correct_answer):
+    """1.0 si l'option choisie correspond à l'option correcte, 0.0 sinon."""
+    user_option = option_text(user_response)
+    correct_option = option_text(correct_answer)
+    if user_option and correct_option:
+        return 1.0 if user_option == correct_option else 0.0
+    # Option sans texte (seulement la lettre) : comparer le texte complet normalisé
+    normalized_user_response = normalize_text(user_response)
+    return 1.0 if normalized_user_response and normalized_user_response == normalize_text(correct_answer) else 0.0
+
+# Similarité au-dessus de laquelle une réponse est correcte (vous pouvez ajuster le seuil)
+SIMILARITY_THRESHOLD = 0.7
+
+def score_result(result, similarity):
+    # Si la similarité est élevée, on considère que la réponse est correcte
+    is_correct = similarity > SIMILARITY_THRESHOLD
+    result['is_correct'] = is_correct
+    result['similarity'] = similarity
+    if not is_correct:
+        result['points'] = 0
+
+@timed('comparison')
+def compare_responses_batch(annotated_sheets, answer_key):
+    """Comparer les réponses de plusieurs copies ; toutes les similarités par embeddings sont calculées en un seul lot."""
+    sheets_results = []
+    # Paires (résultat, réponse de l'étudiant, index de la réponse correcte) à noter avec le modèle
+    pending_pairs = []
+    # Index dans le corrigé de chaque résultat, copie par copie
+    sheets_answer_indexes = []
+    for annotated in annotated_sheets:
+        results = []
+        answer_indexes = []
+        for annotated_data in annotated:
+            # Trouver la réponse correcte pour la question
+            answer_index = answer_key.find(annotated_data['question'])
+            if answer_index is None:
+                continue
+
+            correct_data = answer_key.answers[answer_index]
+            correct_answer = correct_data['answer']
+            user_response = annotated_data['response']
+            rect = annotated_data['question_rect']
+            strategy = grading_strategy(annotated_data.get('type'))
+
+            if correct_answer:
+                result = {
+                    'question': correct_data['question'],
+                    'user_response': user_response,
+                    'correct_answer': correct_answer,
+                    'is_correct': False,
+                    'similarity': 0.0,
+                    'points': correct_data['points'],
+                    'question_rect': rect,
+                    'page_num': annotated_data.get('page_num'),
+                    'strategy': strategy,
+                }
+                if strategy == 'option' and annotated_data.get('option'):
+                    # Comparer l'option imprimée choisie plutôt que le texte capturé, souvent tronqué
+                    score_result(result, option_similarity(annotated_data['option'], correct_answer))
+                else:
+                    if strategy == 'option':
+                        # Aucune option identifiée avec certitude : le texte capturé est noté par le modèle
+                        result['strategy'] = 'embedding'
+                    # La similarité est calculée plus bas, en un seul passage du modèle
+                    pending_pairs.append((result, user_response, answer_index))
+                results.append(result)
+                answer_indexes.append(answer_index)
+            else: 
+                results.append({
+                    'question': correct_data['question'],
+                    'user_response': user_response,
+                    'correct_answer': None,
+                    'is_correct': False,
+                    'similarity': 0.0,
+                    'points': 0,
+                    'question_rect': rect,
+                    'page_num': annotated_data.get('page_num'),
+                    'strategy': strategy,
+                })
+                answer_indexes.append(answer_index)
+        sheets_results.append(results)
+        sheets_answer_indexes.append(answer_indexes)
+
+    if pending_pairs:
+        user_responses = [user_response for _, user_response, _ in pending_pairs]
+        answer_indexes = [answer_index for _, _, answer_index in pending_pairs]
+        if answer_key.answer_embeddings is not None:
+            # Les réponses correctes sont déjà encodées : seules les réponses des étudiants passent dans le modèle
+            user_embeddings = encode_text(user_responses)
+            correct_embeddings = answer_key.answer_embeddings[[answer_key.embedding_rows[index] for index in answer_indexes]]
+            similarities = paired_cosine_similarities(user_embeddings, correct_embeddings)
+        else:
+            similarities = pairwise_similarities(
+                user_responses,
+                [answer_key.answers[index]['answer'] for index in answer_indexes],
+            )
+        for (result, _, _), similarity in zip(pending_pairs, similarities):
+            score_result(result, similarity)
+
+    # Plusieurs marques rattachées à la même question : ses points ne sont comptés qu'une fois par copie
+    for results, answer_indexes in zip(sheets_results, sheets_answer_indexes):
+        credited = set()
+        for result, answer_index in zip(results, answer_indexes):
+            if result['points'] and answer_index in credited:
+                result['points'] = 0
+            elif result['points']:
+                credited.add(answer_index)
+
+    return sheets_results
+
+def clean_correct_answers(correct_answers):
+    """Supprimer le HTML des réponses et des questions du corrigé."""
+    return [{'answer': clean_html(ans['answer']), 'question': clean_html(ans['question']), 'points': ans['points']} for ans in correct_answers]
+
+# Corrigés enregistrés : chaque version brute est écrite sur disque (partagée entre les workers gunicorn
+# et conservée après un redémarrage, pour les travaux qui l'ont figée), la dernière aussi sous
+# <exam_id>.json ; la version compilée est gardée en mémoire dans un cache LRU borné
+ANSWER_KEYS_DIR = os.environ.get('ANSWER_KEYS_DIR', '/data/answer_keys')
+ANSWER_KEYS_CACHE_SIZE = int(os.environ.get('ANSWER_KEYS_CACHE_SIZE', '32'))
+_answer_keys = OrderedDict()  # (exam_id, version) -> AnswerKey
+_answer_keys_lock = threading.Lock()
+
+class AnswerKeyError(Exception):
+    """Corrigé enregistré introuvable ou dont la version ne correspond pas."""
+
+    def __init__(self, message, status_code):
+        super().__init__(message)
+        self.status_code = status_code
+
+def exam_file_path(directory, exam_id, extension):
+    if not re.fullmatch(r'[A-Za-z0-9_-]+', exam_id):
+        raise AnswerKeyError('Invalid exam_id', 400)
+    return os.path.join(directory, f"{exam_id}.{extension}")
+
+def answer_key_path(exam_id, version=None):
+    """Dernière version du corrigé, ou la version donnée (answer_keys/<exam_id>/<version>.json)."""
+    path = exam_file_path(ANSWER_KEYS_DIR, exam_id, 'json')
+    if version is None:
+        return path
+    if not re.fullmatch(r'[0-9a-f]{16}', version):
+        raise AnswerKeyError('Answer key version mismatch', 409)
+    return os.path.join(ANSWER_KEYS_DIR, exam_id, f"{version}.json")
+
+def _write_json(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+def _cache_answer_key(exam_id, version, answer_key):
+    answer_key.version = version
+    with _answer_keys_lock:
+        _answer_keys[(exam_id, version)] = answer_key
+        _answer_keys.move_to_end((exam_id, version))
+        while len(_answer_keys) > ANSWER_KEYS_CACHE_SIZE:
+            _answer_keys.popitem(last=False)
+
+def register_answer_key(exam_id, correct_answers):
+    """Enregistrer et compiler le corrigé d'un examen ; renvoie sa version (empreinte du contenu)."""
+    path = answer_key_path(exam_id)
+    version = hashlib.sha256(json.dumps(correct_answers, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+    answer_key = AnswerKey(clean_correct_answers(correct_answers), with_embeddings=True)
+
+    stored = {'version': version, 'correct_answers': correct_answers}
+    # La version d'abord : la dernière version désignée est toujours lisible sous son propre nom
+    _write_json(answer_key_path(exam_id, version), stored)
+    _write_json(path, stored)
+
+    _cache_answer_key(exam_id, version, answer_key)
+    return version
+
+def get_answer_key(exam_id, version=None):
+    """Corrigé compilé d'un examen ; la dernière version enregistrée si version n'est pas précisée."""
+    path = answer_key_path(exam_id)
+    if version:
+        with _answer_keys_lock:
+            answer_key = _answer_keys.get((exam_id, version))
+            if answer_key is not None:
+                _answer_keys.move_to_end((exam_id, version))
+                return answer_key
+
+    stored = None
+    if version:
+        try:
+            with open(answer_key_path(exam_id, version)) as f:
+                stored = json.load(f)
+        except FileNotFoundError:
+            pass
+    if stored is None:
+        try:
+            with open(path) as f:
+                stored = json.load(f)
+        except FileNotFoundError:
+            raise AnswerKeyError('Unknown exam_id', 404)
+
+    # Version demandée jamais enregistrée (ni dernière version d'un corrigé enregistré avant le
+    # stockage par version)
+    if version and stored['version'] != version:
+        raise AnswerKeyError('Answer key version mismatch', 409)
+    version = stored['version']
+
+    with _answer_keys_lock:
+        answer_key = _answer_keys.get((exam_id, version))
+    if answer_key is None:
+        answer_key = AnswerKey(clean_correct_answers(stored['correct_answers']), with_embeddings=True)
+    _cache_answer_key(exam_id, version, answer_key)
+    return answer_key
+
+def request_answer_key():
+    """Corrigé d'une requête de correction : envoyé en entier dans correct_answers, sinon référencé par exam_id.
+
+    Le corrigé envoyé est prioritaire : exam_id peut n'être là que pour le sujet vierge enregistré.
+    """
+    correct_answers = json.loads(request.form.get('correct_answers') or 'null')
+    if correct_answers:
+        return AnswerKey(clean_correct_answers(correct_answers))
+
+    exam_id = request.form.get('exam_id')
+    if exam_id:
+        return get_answer_key(exam_id, request.form.get('answer_key_version'))
+    return None
+
+# Sujets vierges enregistrés : le PDF est écrit sur disque, le sujet analysé est gardé en mémoire
+# (cache LRU borné) et rechargé quand le fichier est remplacé
+TEMPLATES_DIR = os.environ.get('TEMPLATES_DIR', '/data/templates')
+TEMPLATES_CACHE_SIZE = int(os.environ.get('TEMPLATES_CACHE_SIZE', '8'))
+_templates = OrderedDict()  # exam_id -> ((mtime, taille) du fichier, SheetTemplate)
+_templates_lock = threading.Lock()
+
+def template_path(exam_id):
+    return exam_file_path(TEMPLATES_DIR, exam_id, 'pdf')
+
+def _cache_template(exam_id, signature, template):
+    with _templates_lock:
+        _templates[exam_id] = (signature, template)
+        _templates.move_to_end(exam_id)
+        while len(_templates) > TEMPLATES_CACHE_SIZE:
+            _templates.popitem(last=False)
+
+def register_template(exam_id, pdf_bytes):
+    """Enregistrer le sujet vierge d'un examen et renvoyer le sujet analysé."""
+    path = template_path(exam_id)
+    template = SheetTemplate(pdf_bytes)
+
+    os.makedirs(TEMPLATES_DIR, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(pdf_bytes)
+    os.replace(tmp_path, path)
+
+    stat = os.stat(path)
+    _cache_template(exam_id, (stat.st_mtime_ns, stat.st_size), template)
+    return template
+
+def get_template(exam_id):
+    """Sujet vierge analysé d'un examen, ou None s'il n'a pas été enregistré."""
+    path = template_path(exam_id)
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    signature = (stat.st_mtime_ns, stat.st_size)
+
+    with _templates_lock:
+        cached = _templates.get(exam_id)
+        if cached is not None and cached[0] == signature:
+            _templates.move_to_end(exam_id)
+            return cached[1]
+
+    with open(path, 'rb') as f:
+        template = SheetTemplate(f.read())
+    _cache_template(exam_id, signature, template)
+    return template
+
+def request_template():
+    """Sujet vierge de l'examen référencé par la requête, s'il a été enregistré."""
+    exam_id = request.form.get('exam_id')
+    return get_template(exam_id) if exam_id else None
+
+_process_pool = None
+
+def get_process_pool():
+    """Pool de processus pour l'analyse des PDF, créé à la première utilisation dans chaque worker."""
+    global _process_pool
+    if _process_pool is None:
+        _process_pool = ProcessPoolExecutor(max_workers=cpu_quota())
+    return _process_pool
+
+# Résultats des corrections, réutilisés quand la même copie est corrigée à nouveau avec le même corrigé
+# (base partagée par les workers sur le volume persistant)
+result_cache = ResultCache(
+    os.environ.get('RESULTS_CACHE_PATH', '/data/results.sqlite3'),
+    int(os.environ.get('RESULTS_CACHE_MAX_MB', '256')) * 1024 * 1024,
+)
+
+# Version de l'analyse et de la notation, et du format des résultats : à incrémenter quand une
+# modification du code change les résultats, pour ne plus servir ceux enregistrés auparavant
+GRADING_VERSION = 2
+
+def result_cache_key(pdf_bytes, answer_key, template=None):
+    """Clé du résultat : version de la correction, contenu du PDF, corrigé, sujet vierge et modèle."""
+    return hashlib.sha256(json.dumps([
+        GRADING_VERSION,
+        hashlib.sha256(pdf_bytes).hexdigest(),
+        answer_key.fingerprint,
+        template.version if template else None,
+        EMBEDDING_MODEL,
+        EMBEDDING_BACKEND,
+    ]).encode('utf-8')).hexdigest()
+
+def lookup_result(pdf_bytes, answer_key, template=None, cache_control='', sheet_id=None):
+    """Chercher le résultat d'une copie déjà corrigée.
+
+    Renvoie (clé sous laquelle enregistrer le nouveau résultat ou None, résultat en cache ou
+    None, 'hit'/'miss'/'bypass'). Cache-Control: no-cache force une nouvelle correction qui
+    remplace le résultat enregistré ; no-store ne lit ni n'enregistre rien. Une copie identifiée
+    (sheet_id) dont les réponses ne sont pas encore conservées est toujours analysée.
+    """
+    if not result_cache.enabled:
+        return None, None, None
+    if 'no-store' in cache_control:
+        observe_result_cache('bypass')
+        return None, None, 'bypass'
+    cache_key = result_cache_key(pdf_bytes, answer_key, template)
+    if 'no-cache' in cache_control or (sheet_id and not responses_stored(sheet_id, pdf_bytes)):
+        observe_result_cache('bypass')
+        return cache_key, None, 'bypass'
+    cached = result_cache.get(cache_key)
+    status = 'hit' if cached is not None else 'miss'
+    observe_result_cache(status)
+    return cache_key, cached, status
+
+def result_response(payload, cache_status, doc=None):
+    """Réponse JSON ; avec doc, la copie corrigée est jointe en base64 (annotated_pdf)."""
+    if doc is not None:
+        with timed('annotation'):
+            payload['annotated_pdf'] = base64.b64encode(
+                annotate_sheet(doc, payload['results'])
+            ).decode('ascii')
+    response = jsonify(payload)
+    if cache_status:
+        response.headers['X-Result-Cache'] = cache_status
+    return response
+
+# Réponses associées de chaque copie identifiée (sheet_id), pour la corriger à nouveau avec un
+# autre corrigé sans relire le PDF (POST /regrade)
+response_store = ResponseStore(os.environ.get('RESPONSES_DB_PATH', '/data/responses.sqlite3'))
+
+def responses_stored(sheet_id, pdf_bytes):
+    """Réponses de cette version de la copie déjà conservées ; une base illisible compte comme absente."""
+    try:
+        return response_store.contains(sheet_id, hashlib.sha256(pdf_bytes).hexdigest())
+    except Exception as e:
+        logger.info(f"Unable to look up stored responses of sheet {sheet_id}: {e}")
+        return False
+
+def store_responses(sheet_id, exam_id, pdf_bytes, associated_responses):
+    """Conserver les réponses d'une copie ; un échec n'empêche pas de renvoyer la correction."""
+    try:
+        response_store.put(sheet_id, exam_id, hashlib.sha256(pdf_bytes).hexdigest(), associated_responses)
+    except Exception as e:
+        logger.info(f"Unable to store responses of sheet {sheet_id}: {e}")
+
+def parse_sheet(pdf_bytes, template=None):
+    """Extraire les réponses annotées d'une copie (exécuté dans le pool de processus)."""
+    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+    student_info, grouped_questions, page_annotations = extract_sheet(doc, template=template)
+    return associate_responses_with_questions(grouped_questions, page_annotations)
  
 @app.route('/analyze_qcm', methods=['POST'])
 def analyze_qcm():
     try:
         pdf_file = request.files['pdf']
-        correct_answers = json.loads(request.form.get('correct_answers'))
-        pdf_path = "/tmp/tempfile.pdf"
-        pdf_file.save(pdf_path)
+        answer_key = request_answer_key()
+        template = request_template()
+        # Le PDF reste en mémoire : pas de fichier temporaire partagé entre les requêtes
+        with timed('upload'):
+            pdf_bytes = pdf_file.read()
+
+        if not pdf_bytes or not answer_key:
+            return jsonify({'error': 'Missing pdf or correct_answers'}), 400
+
+        sheet_id = request.form.get('sheet_id')
+        # output=pdf : la copie corrigée est renvoyée avec les résultats
+        annotate = request.form.get('output') == 'pdf'
+        cache_key, cached_results, cache_status = lookup_result(
+            pdf_bytes, answer_key, template, request.headers.get('Cache-Control', ''), sheet_id
+        )
+        if cached_results is not None:
+            doc = fitz.open(stream=pdf_bytes, filetype="pdf") if annotate else None
+            return result_response({'results': cached_results}, cache_status, doc)
+
+        # Structures complètes journalisées pour une partie seulement des requêtes
+        debug_dump = sample_debug_dump()
+        if debug_dump:
+            logger.info("cleaned_correct_answers:>>>>>>>>>>>> %s", answer_key.answers)
+
+        # Ouvrir le document PDF une seule fois pour toutes les étapes
+        doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+
+        # Extraire le texte, les questions et les annotations des réponses des étudiants
+        student_info, grouped_questions, page_annotations = extract_sheet(doc, pdf_bytes, template)
+        if debug_dump:
+            logger.info("grouped questions>>>>>> %s", grouped_questions)
+            logger.info("page annotations >>>>>>> %s", page_annotations)
 
-        if not pdf_path or not correct_answers:
-            return jsonify({'error': 'Missing pdf_path or correct_answers'}), 400
+        # Associer les annotations des réponses aux questions
+        associated_responses = associate_responses_with_questions(grouped_questions, page_annotations)
+        if debug_dump:
+            logger.info("associated_responses>>>>>>>>> %s", associated_responses)
+        if sheet_id:
+            store_responses(sheet_id, request.form.get('exam_id'), pdf_bytes, associated_responses)
 
-        # Nettoyer les réponses correctes
-        cleaned_correct_answers = [{'answer': clean_html(ans['answer']), 'question': clean_html(ans['question']), 'points': ans['points']} for ans in correct_answers]
-        logger.info("cleaned_correct_answers:>>>>>>>>>>>> %s", cleaned_correct_answers)
+        # Comparer les réponses annotées avec les réponses correctes
+        comparison_results = compare_responses_batch([associated_responses], answer_key)[0]
+        if debug_dump:
+            logger.info("comparison_results: %s", comparison_results)
 
-        # Extraire le texte et les annotations du PDF
-        student_info, grouped_questions = extract_text_and_annotations(pdf_path)
-        logger.info("grouped questions>>>>>> %s", grouped_questions)
-        logger.info("")
-        # Ouvrir le document PDF
-        doc = fitz.open(pdf_path)
+        if cache_key:
+            result_cache.put(cache_key, comparison_results)
+        return result_response({'results': comparison_results}, cache_status, doc if annotate else None)
 
-        # Extraire les annotations spécifiques des réponses des étudiants
-        page_annotations = extract_annotations(doc)
-        logger.info("page annotations >>>>>>> %s", page_annotations)
-        logger.info("")
+    except AnswerKeyError as e:
+        return jsonify({'error': str(e)}), e.status_code
+    except Exception as e:
+        logger.info(f"Error: {e}")
+        return jsonify({'error': 'Internal Server Error'}), 500
 
-        # Associer les annotations des réponses aux questions
-        associated_responses = associate_responses_with_questions(grouped_questions, page_annotations)
-        logger.info("associated_responses>>>>>>>>> %s", associated_responses)
-        logger.info("")
+@app.route('/analyze_qcm_batch', methods=['POST'])
+def analyze_qcm_batch():
+    try:
+        pdf_files = request.files.getlist('pdfs')
+        answer_key = request_answer_key()
+        template = request_template()
+
+        if not pdf_files or not answer_key:
+            return jsonify({'error': 'Missing pdfs or correct_answers'}), 400
+
+        filenames = [pdf_file.filename for pdf_file in pdf_files]
+        if len(set(filenames)) != len(filenames):
+            return jsonify({'error': 'Duplicate pdf filenames'}), 400
+
+        with timed('upload'):
+            pdf_contents = [pdf_file.read() for pdf_file in pdf_files]
+
+        # Analyse des PDF en parallèle ; une copie illisible n'empêche pas la correction des autres
+        results = {}
+        parsed_filenames = []
+        parsed_sheets = []
+        if len(pdf_contents) == 1 or cpu_quota() == 1:
+            for filename, pdf_bytes in zip(filenames, pdf_contents):
+                try:
+                    parsed_sheets.append(parse_sheet(pdf_bytes, template))
+                    parsed_filenames.append(filename)
+                except Exception as e:
+                    logger.info(f"Error while parsing {filename}: {e}")
+                    results[filename] = {'error': 'Unable to parse pdf'}
+        else:
+            futures = [get_process_pool().submit(parse_sheet, pdf_bytes, template) for pdf_bytes in pdf_contents]
+            for filename, future in zip(filenames, futures):
+                try:
+                    parsed_sheets.append(future.result())
+                    parsed_filenames.append(filename)
+                except Exception as e:
+                    logger.info(f"Error while parsing {filename}: {e}")
+                    results[filename] = {'error': 'Unable to parse pdf'}
 
-        # Comparer les réponses annotées avec les réponses correctes
-        comparison_results = compare_responses(associated_responses, cleaned_correct_answers)
-        logger.info("comparison_results: %s",comparison_results)
+        # Comparaison de toutes les copies avec un seul passage du modèle
+        comparison_results = compare_responses_batch(parsed_sheets, answer_key)
+        for filename, sheet_results in zip(parsed_filenames, comparison_results):
+            results[filename] = {'results': sheet_results}
+
+        return jsonify({'results': results})
 
-        return jsonify({'results': comparison_results})
+    except AnswerKeyError as e:
+        return jsonify({'error': str(e)}), e.status_code
+    except Exception as e:
+        logger.info(f"Error: {e}")
+        return jsonify({'error': 'Internal Server Error'}), 500
+
+@app.route('/answer_keys/<exam_id>', methods=['PUT'])
+def put_answer_key(exam_id):
+    try:
+        payload = request.get_json(silent=True) or {}
+        correct_answers = payload.get('correct_answers')
+        if not correct_answers:
+            return jsonify({'error': 'Missing correct_answers'}), 400
 
+        version = register_answer_key(exam_id, correct_answers)
+        return jsonify({'exam_id': exam_id, 'version': version})
+
+    except AnswerKeyError as e:
+        return jsonify({'error': str(e)}), e.status_code
     except Exception as e:
         logger.info(f"Error: {e}")
         return jsonify({'error': 'Internal Server Error'}), 500
 
+@app.route('/templates/<exam_id>', methods=['PUT'])
+def put_template(exam_id):
+    try:
+        pdf_file = request.files.get('pdf')
+        pdf_bytes = pdf_file.read() if pdf_file else None
+        if not pdf_bytes:
+            return jsonify({'error': 'Missing pdf'}), 400
+
+        try:
+            template = register_template(exam_id, pdf_bytes)
+        except fitz.FileDataError:
+            return jsonify({'error': 'Invalid pdf'}), 400
+        return jsonify({
+            'exam_id': exam_id,
+            'version': template.version,
+            'pages': len(template.pages),
+            'questions': len(template.grouped_questions),
+        })
+
+    except AnswerKeyError as e:
+        return jsonify({'error': str(e)}), e.status_code
+    except Exception as e:
+        logger.info(f"Error: {e}")
+        return jsonify({'error': 'Internal Server Error'}), 500
+
+def run_grading_job(pdf_bytes, params):
+    """Corriger une copie de la file d'attente asynchrone."""
+    if params.get('correct_answers'):
+        answer_key = AnswerKey(clean_correct_answers(params['correct_answers']))
+    else:
+        answer_key = get_answer_key(params['exam_id'], params.get('answer_key_version'))
+    template = get_template(params['exam_id']) if params.get('exam_id') else None
+
+    # Travail relancé après un redémarrage, ou copie déjà corrigée par /analyze_qcm
+    sheet_id = params.get('sheet_id')
+    cache_key, cached_results, _ = lookup_result(pdf_bytes, answer_key, template, sheet_id=sheet_id)
+    if cached_results is not None:
+        return cached_results
+
+    # L'analyse du PDF est faite dans le pool de processus pour ne pas bloquer les requêtes HTTP
+    associated_responses = get_process_pool().submit(parse_sheet, pdf_bytes, template).result()
+    if sheet_id:
+        store_responses(sheet_id, params.get('exam_id'), pdf_bytes, associated_responses)
+    comparison_results = compare_responses_batch([associated_responses], answer_key)[0]
+    if cache_key:
+        result_cache.put(cache_key, comparison_results)
+    return comparison_results
+
+# File d'attente des corrections asynchrones, persistée dans SQLite
+job_queue = JobQueue(
+    os.environ.get('JOBS_DB_PATH', '/data/jobs.sqlite3'),
+    run_grading_job,
+    workers=int(os.environ.get('JOBS_WORKERS', '1')),
+    max_pending=int(os.environ.get('JOBS_MAX_PENDING', '100')),
+    lease_seconds=int(os.environ.get('JOBS_LEASE_SECONDS', '60')),
+)
+
+@app.before_request
+def start_job_queue():
+    # Démarré dans chaque worker après le fork (le module est importé par le maître avec --preload)
+    try:
+        job_queue.start()
+    except Exception as e:
+        # Base des travaux inaccessible : seuls /jobs échouent, les autres routes restent servies
+        # (nouvelle tentative à la requête suivante)
+        logger.warning(f"Job queue not started: {e}")
+
+@app.route('/jobs', methods=['POST'])
+def create_job():
+    try:
+        pdf_file = request.files.get('pdf')
+        with timed('upload'):
+            pdf_bytes = pdf_file.read() if pdf_file else None
+
+        exam_id = request.form.get('exam_id')
+        correct_answers = json.loads(request.form.get('correct_answers') or 'null')
+        if correct_answers:
+            # Corrigé envoyé prioritaire ; exam_id sert alors au sujet vierge et au stockage des réponses
+            params = {'correct_answers': correct_answers}
+            if exam_id:
+                params['exam_id'] = exam_id
+        elif exam_id:
+            # Vérifier le corrigé dès maintenant et figer sa version pour ce travail
+            answer_key = get_answer_key(exam_id, request.form.get('answer_key_version'))
+            params = {'exam_id': exam_id, 'answer_key_version': answer_key.version}
+        else:
+            params = None
+
+        if not pdf_bytes or not params:
+            return jsonify({'error': 'Missing pdf or correct_answers'}), 400
+        if request.form.get('sheet_id'):
+            params['sheet_id'] = request.form['sheet_id']
+
+        job_id = job_queue.submit(pdf_bytes, params)
+        response = jsonify({'job_id': job_id, 'status': 'queued'})
+        response.headers['Location'] = f"/jobs/{job_id}"
+        return response, 202
+
+    except QueueFullError as e:
+        logger.info(f"Job queue full: {e}")
+        response = jsonify({'error': 'Too many pending jobs'})
+        response.headers['Retry-After'] = '30'
+        return response, 429
+    except AnswerKeyError as e:
+        return jsonify({'error': str(e)}), e.status_code
+    except Exception as e:
+        logger.info(f"Error: {e}")
+        return jsonify({'error': 'Internal Server Error'}), 500
+
+@app.route('/regrade', methods=['POST'])
+def regrade():
+    """Corriger à nouveau des copies déjà analysées, sans relire leurs PDF.
+
+    Corps JSON : le nouveau corrigé (correct_answers, sinon exam_id d'un corrigé enregistré) et les
+    copies (sheet_ids ; par défaut, avec exam_id, toutes les copies enregistrées pour cet examen).
+    """
+    try:
+        payload = request.get_json(silent=True) or {}
+        exam_id = payload.get('exam_id')
+        # Corrigé envoyé prioritaire, comme pour /analyze_qcm : exam_id peut ne servir qu'à choisir les copies
+        if payload.get('correct_answers'):
+            answer_key = AnswerKey(clean_correct_answers(payload['correct_answers']))
+        elif exam_id:
+            answer_key = get_answer_key(exam_id, payload.get('answer_key_version'))
+        else:
+            return jsonify({'error': 'Missing correct_answers'}), 400
+
+        sheet_ids = payload.get('sheet_ids')
+        if sheet_ids is None and exam_id:
+            sheet_ids = response_store.sheet_ids(exam_id)
+        if not isinstance(sheet_ids, list) or not all(isinstance(sheet_id, str) for sheet_id in sheet_ids):
+            return jsonify({'error': 'Missing sheet_ids'}), 400
+        sheet_ids = list(dict.fromkeys(sheet_ids))
+
+        # Comparaison de toutes les copies avec un seul passage du modèle
+        stored = response_store.get_many(sheet_ids)
+        found_ids = [sheet_id for sheet_id in sheet_ids if sheet_id in stored]
+        comparison_results = compare_responses_batch([stored[sheet_id] for sheet_id in found_ids], answer_key)
+
+        results = {sheet_id: {'error': 'Unknown sheet_id'} for sheet_id in sheet_ids if sheet_id not in stored}
+        for sheet_id, sheet_results in zip(found_ids, comparison_results):
+            results[sheet_id] = {'results': sheet_results}
+        return jsonify({'results': results})
+
+    except AnswerKeyError as e:
+        return jsonify({'error': str(e)}), e.status_code
+    except Exception as e:
+        logger.info(f"Error: {e}")
+        return jsonify({'error': 'Internal Server Error'}), 500
+
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    # Sonde de vivacité : le worker répond
+    return jsonify({'status': 'ok'})
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    data, content_type = latest_metrics()
+    return Response(data, headers={'Content-Type': content_type})
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    try:
+        job = job_queue.get(job_id)
+        if job is None:
+            return jsonify({'error': 'Unknown job_id'}), 404
+        return jsonify(job)
+
+    except Exception as e:
+        logger.info(f"Error: {e}")
+        return jsonify({'error': 'Internal Server Error'}), 500
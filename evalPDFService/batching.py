@@ -0,0 +1,124 @@
+"""Regroupement des appels au modèle d'embeddings entre requêtes concurrentes.
+
+Avec les workers gevent de gunicorn, chaque requête appelait le modèle seule : les appels
+concurrents se succédaient sur le CPU et bloquaient la boucle d'événements pendant le calcul.
+Les textes de toutes les requêtes en cours sont mis en file ; un seul thread par processus les
+encode par lots (dès que max_batch_size textes attendent, ou max_wait_ms après l'arrivée du
+plus ancien) et rend à chaque appelant ses vecteurs. Sous gevent, le calcul est fait dans un
+vrai thread du hub : la boucle d'événements continue de servir les requêtes pendant l'inférence.
+"""
+
+import logging
+import os
+import threading
+import time
+
+try:
+    import gevent
+    from gevent import monkey
+except ImportError:  # Serveur de développement Flask, sans gevent
+    gevent = None
+
+logger = logging.getLogger(__name__)
+
+
+def run_blocking(function, *args):
+    """Exécuter un calcul long hors de la boucle d'événements de gevent quand elle est active."""
+    if gevent is not None and monkey.is_module_patched('threading'):
+        return gevent.get_hub().threadpool.apply(function, args)
+    return function(*args)
+
+
+class _Request:
+    """Textes d'un appelant en attente de leurs vecteurs."""
+
+    def __init__(self, texts):
+        self.texts = texts
+        self.created_at = time.monotonic()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class EmbeddingBatcher:
+    """File des textes à encoder, vidée par lots par un thread propre à chaque processus.
+
+    encode(texts) reçoit une liste de textes et renvoie un tenseur (une ligne par texte).
+    """
+
+    def __init__(self, encode, max_batch_size=64, max_wait_ms=0.0):
+        self.encode = encode
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+
+        self._lock = threading.Lock()
+        self._started_pid = None
+        self._condition = None
+        self._pending = []
+
+    def _start(self):
+        """Démarrer le thread du processus courant (après le fork, une fois gevent installé)."""
+        if self._started_pid == os.getpid():
+            return
+        with self._lock:
+            if self._started_pid == os.getpid():
+                return
+            # Créés dans le worker : ils doivent être ceux de gevent si la bibliothèque standard est patchée
+            self._condition = threading.Condition()
+            self._pending = []
+            thread = threading.Thread(target=self._run, daemon=True)
+            self._started_pid = os.getpid()
+        # Démarré hors du verrou (créé avant le patch de gevent) : start() passe la main aux autres requêtes
+        thread.start()
+
+    def submit(self, texts):
+        """Encoder texts avec ceux des autres requêtes en cours ; seul l'appelant attend."""
+        if not texts:
+            return self.encode(texts)
+        self._start()
+        request = _Request(texts)
+        with self._condition:
+            self._pending.append(request)
+            self._condition.notify()
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def _next_batch(self):
+        """Attendre un lot complet, ou l'échéance de la plus ancienne demande."""
+        with self._condition:
+            while not self._pending:
+                self._condition.wait()
+            deadline = self._pending[0].created_at + self.max_wait
+            while sum(len(request.texts) for request in self._pending) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+
+            # Demandes entières, dans l'ordre d'arrivée ; une demande plus grande qu'un lot part seule
+            batch, size = [], 0
+            while self._pending and (not batch or size + len(self._pending[0].texts) <= self.max_batch_size):
+                request = self._pending.pop(0)
+                batch.append(request)
+                size += len(request.texts)
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                embeddings = run_blocking(self.encode, [text for request in batch for text in request.texts])
+            except Exception as e:
+                logger.info(f"Embedding batch of {len(batch)} requests failed: {e}")
+                for request in batch:
+                    request.error = e
+                    request.done.set()
+                continue
+
+            start = 0
+            for request in batch:
+                request.result = embeddings[start:start + len(request.texts)]
+                start += len(request.texts)
+                request.done.set()
@@ -0,0 +1,332 @@
+"""Benchmark de la chaîne de correction de evalPDFService.
+
+Génère des copies synthétiques, chronomètre chaque fonction de la chaîne séparément puis la
+requête /analyze_qcm de bout en bout, et compare les résultats à une référence enregistrée :
+le script se termine avec le code 1 si une étape a ralenti au-delà de la tolérance.
+
+    python benchmark/bench.py                      # comparer à benchmark/baseline.json
+    python benchmark/bench.py --save-baseline      # enregistrer une nouvelle référence
+    python benchmark/bench.py --pages 4 --marks check,underline --real-model
+    python benchmark/bench.py --template           # copies d'un même sujet, comparées au sujet vierge
+    python benchmark/bench.py --real-model --backend-drift   # écart des similarités int8 / fp32
+
+Les temps dépendent de la machine : la référence doit être enregistrée sur la machine où le
+benchmark est lancé.
+"""
+
+import argparse
+import io
+import json
+import logging
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+
+from sheets import DEFAULT_FONT, MARKS, make_sheet  # noqa: E402
+import stub_model  # noqa: E402
+
+DEFAULT_BASELINE = os.path.join(BENCHMARK_DIR, 'baseline.json')
+
+
+def percentile(values, fraction):
+    """Percentile au rang le plus proche."""
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(fraction * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+
+def summarize(seconds):
+    return {
+        'p50_ms': percentile(seconds, 0.50) * 1000,
+        'p99_ms': percentile(seconds, 0.99) * 1000,
+        'mean_ms': sum(seconds) / len(seconds) * 1000,
+    }
+
+
+def peak_rss_mb():
+    """Mémoire résidente maximale de ce processus et des processus du pool (en Mo)."""
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    # ru_maxrss est en kilo-octets sous Linux, en octets sous macOS
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return own / scale, children / scale
+
+
+def timed_call(timings, name, function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    timings.setdefault(name, []).append(time.perf_counter() - start)
+    return result
+
+
+def run(args):
+    if not args.real_model:
+        stub_model.install()
+
+    # La file des corrections asynchrones est démarrée par la première requête : hors de /data,
+    # comme les corrigés, sujets et résultats enregistrés
+    work_dir = tempfile.mkdtemp()
+    os.environ.setdefault('RESULTS_CACHE_PATH', os.path.join(work_dir, 'results.sqlite3'))
+    os.environ.setdefault('JOBS_DB_PATH', os.path.join(work_dir, 'jobs.sqlite3'))
+    os.environ.setdefault('ANSWER_KEYS_DIR', os.path.join(work_dir, 'answer_keys'))
+    os.environ.setdefault('TEMPLATES_DIR', os.path.join(work_dir, 'templates'))
+    # Les mêmes copies reviennent à chaque répétition : sans cache, chaque réponse passe dans le modèle
+    os.environ.setdefault('EMBEDDING_CACHE_MAX_MB', '0')
+
+    import fitz  # PyMuPDF
+    import app
+
+    logging.getLogger('app').setLevel(logging.WARNING)
+    client = app.app.test_client()
+
+    marks = tuple(mark for mark in args.marks.split(',') if mark)
+    layout = (args.pages, args.questions_per_page, args.options)
+    template = None
+    if args.template:
+        # Copies d'un même sujet, dont le sujet vierge et le corrigé sont enregistrés
+        blank_pdf, blank_answers = make_sheet(*layout, marks=(), open_ratio=args.open_ratio,
+                                              seed=args.seed, font_file=args.font)
+        template = app.register_template('benchmark', blank_pdf)
+        app.register_answer_key('benchmark', blank_answers)
+        sheets = [
+            (make_sheet(*layout, marks, args.open_ratio, seed=args.seed, student_seed=args.seed + index,
+                        font_file=args.font)[0], blank_answers)
+            for index in range(args.sheets)
+        ]
+    else:
+        sheets = [
+            make_sheet(*layout, marks, args.open_ratio, seed=args.seed + index, font_file=args.font)
+            for index in range(args.sheets)
+        ]
+
+    timings = {}
+    end_to_end = []
+    graded = 0
+    failures = 0
+    for iteration in range(args.warmup + args.repeat):
+        warmup = iteration < args.warmup
+        measured = {} if warmup else timings
+        for index, (pdf_bytes, correct_answers) in enumerate(sheets):
+            # Chaque fonction de la chaîne, séparément
+            try:
+                answer_key = timed_call(measured, 'answer_key', app.AnswerKey, app.clean_correct_answers(correct_answers))
+                doc = timed_call(measured, 'open', fitz.open, stream=pdf_bytes, filetype='pdf')
+                pages, stage_timings = timed_call(measured, 'extract_pages', app.extract_pages, doc, range(len(doc)), template)
+                for stage, seconds in stage_timings.items():
+                    measured.setdefault(stage, []).append(seconds)
+                # Nouveau document : ne pas profiter des pages déjà analysées par extract_pages
+                doc = fitz.open(stream=pdf_bytes, filetype='pdf')
+                student_info, grouped_questions, page_annotations = timed_call(
+                    measured, 'extract_sheet', app.extract_sheet, doc, template=template,
+                )
+                associated_responses = timed_call(
+                    measured, 'associate_responses_with_questions',
+                    app.associate_responses_with_questions, grouped_questions, page_annotations,
+                )
+                timed_call(measured, 'compare_responses_batch', app.compare_responses_batch, [associated_responses], answer_key)
+            except Exception as e:
+                # Une copie que la chaîne ne sait pas traiter est comptée, pas chronométrée
+                if not warmup:
+                    print(f"sheet {index}: {type(e).__name__}: {e}", file=sys.stderr)
+
+            # Requête complète, comme envoyée par le backend ; le cache des résultats est ignoré pour
+            # mesurer la correction à chaque répétition (le résultat y est tout de même enregistré)
+            start = time.perf_counter()
+            form = {'exam_id': 'benchmark'} if template else {'correct_answers': json.dumps(correct_answers)}
+            response = client.post(
+                '/analyze_qcm', data=dict(form, pdf=(io.BytesIO(pdf_bytes), 'sheet.pdf')),
+                headers={'Cache-Control': 'no-cache'},
+            )
+            elapsed = time.perf_counter() - start
+            if warmup:
+                continue
+            end_to_end.append(elapsed)
+            if response.status_code == 200:
+                graded += len(response.get_json()['results'])
+            else:
+                failures += 1
+
+    own_rss, children_rss = peak_rss_mb()
+    return {
+        'config': {
+            'sheets': args.sheets,
+            'pages': args.pages,
+            'questions_per_page': args.questions_per_page,
+            'options': args.options,
+            'marks': list(marks),
+            'open_ratio': args.open_ratio,
+            'seed': args.seed,
+            'template': args.template,
+            'model': app.EMBEDDING_MODEL if args.real_model else 'stub',
+            'embedding_backend': app.EMBEDDING_BACKEND,
+        },
+        'machine': {
+            'python': platform.python_version(),
+            'pymupdf': fitz.VersionBind,
+            'platform': platform.platform(),
+            'cpus': app.cpu_quota(),
+        },
+        'functions': {name: summarize(seconds) for name, seconds in timings.items()},
+        'end_to_end': dict(
+            summarize(end_to_end),
+            sheets_per_second=len(end_to_end) / sum(end_to_end),
+            graded_answers_per_sheet=graded / len(end_to_end),
+            failed_requests=failures,
+        ),
+        'peak_rss_mb': own_rss,
+        'peak_rss_children_mb': children_rss,
+    }
+
+
+def backend_drift(args):
+    """Écart des similarités cosinus du backend int8 par rapport au modèle fp32.
+
+    Les paires comparées sont celles des corrigés synthétiques (chaque réponse avec chacune des
+    autres, et avec elle-même) ; une paire « change de note » quand les deux backends la placent
+    de part et d'autre de SIMILARITY_THRESHOLD.
+    """
+    import app
+
+    logging.getLogger('app').setLevel(logging.WARNING)
+    answers = []
+    for index in range(args.sheets):
+        _, correct_answers = make_sheet(args.pages, args.questions_per_page, args.options, (), args.open_ratio,
+                                        seed=args.seed + index, font_file=args.font)
+        answers.extend(answer['answer'] for answer in correct_answers)
+    answers = list(dict.fromkeys(answers))
+    pairs = [(a, b) for i, a in enumerate(answers) for b in answers[i:]]
+
+    scores = {}
+    for backend in ('fp32', 'int8'):
+        model = app.model if backend == app.EMBEDDING_BACKEND else app.load_model(backend)
+        embeddings = model.encode(answers, convert_to_tensor=True)
+        rows = {text: row for row, text in enumerate(answers)}
+        scores[backend] = app.paired_cosine_similarities(
+            embeddings[[rows[a] for a, _ in pairs]], embeddings[[rows[b] for _, b in pairs]],
+        )
+
+    drift = [abs(a - b) for a, b in zip(scores['fp32'], scores['int8'])]
+    flips = sum((a > app.SIMILARITY_THRESHOLD) != (b > app.SIMILARITY_THRESHOLD)
+                for a, b in zip(scores['fp32'], scores['int8']))
+    print(f"{len(pairs)} pairs of {len(answers)} answers: |int8 - fp32| max {max(drift):.4f}, "
+          f"mean {sum(drift) / len(drift):.4f}, p99 {percentile(drift, 0.99):.4f}; "
+          f"{flips} pairs change grade at threshold {app.SIMILARITY_THRESHOLD}")
+    return 0
+
+
+def report(results):
+    print(f"{'function':<38}{'p50 ms':>10}{'p99 ms':>10}{'mean ms':>10}")
+    for name, stats in results['functions'].items():
+        print(f"{name:<38}{stats['p50_ms']:>10.2f}{stats['p99_ms']:>10.2f}{stats['mean_ms']:>10.2f}")
+    total = results['end_to_end']
+    print(f"{'end_to_end (/analyze_qcm)':<38}{total['p50_ms']:>10.2f}{total['p99_ms']:>10.2f}{total['mean_ms']:>10.2f}")
+    print(f"throughput: {total['sheets_per_second']:.1f} sheets/s, "
+          f"{total['graded_answers_per_sheet']:.1f} graded answers/sheet, "
+          f"{total['failed_requests']} failed requests")
+    print(f"peak RSS: {results['peak_rss_mb']:.0f} MB (pool processes: {results['peak_rss_children_mb']:.0f} MB)")
+
+
+def regressions(results, baseline, tolerance, min_delta_ms):
+    """Étapes plus lentes (p50), débit plus faible, mémoire plus élevée ou notation différente
+    de la référence.
+
+    Les écarts inférieurs à min_delta_ms sont ignorés : les étapes de quelques dixièmes de
+    milliseconde varient de plus de la tolérance d'une exécution à l'autre.
+    """
+    found = []
+    limit = 1 + tolerance
+    for name, stats in results['functions'].items():
+        reference = baseline['functions'].get(name)
+        if (reference and stats['p50_ms'] > reference['p50_ms'] * limit
+                and stats['p50_ms'] - reference['p50_ms'] > min_delta_ms):
+            found.append(f"{name}: p50 {stats['p50_ms']:.2f} ms > {reference['p50_ms']:.2f} ms")
+    for name in ('p50_ms', 'p99_ms'):
+        if results['end_to_end'][name] > baseline['end_to_end'][name] * limit:
+            found.append(f"end_to_end: {name} {results['end_to_end'][name]:.2f} > {baseline['end_to_end'][name]:.2f}")
+    if results['end_to_end']['sheets_per_second'] * limit < baseline['end_to_end']['sheets_per_second']:
+        found.append(f"throughput: {results['end_to_end']['sheets_per_second']:.1f} sheets/s "
+                     f"< {baseline['end_to_end']['sheets_per_second']:.1f} sheets/s")
+    if results['end_to_end']['failed_requests'] > baseline['end_to_end']['failed_requests']:
+        found.append(f"failed requests: {results['end_to_end']['failed_requests']} "
+                     f"> {baseline['end_to_end']['failed_requests']}")
+    # Mêmes copies synthétiques : un nombre de réponses notées différent signale un changement
+    # de la détection ou de l'association, pas une variation de mesure
+    reference = baseline['end_to_end'].get('graded_answers_per_sheet')
+    if reference is not None and results['end_to_end']['graded_answers_per_sheet'] != reference:
+        found.append(f"graded answers: {results['end_to_end']['graded_answers_per_sheet']:.2f} per sheet "
+                     f"!= {reference:.2f}")
+    if results['peak_rss_mb'] > baseline['peak_rss_mb'] * limit:
+        found.append(f"peak RSS: {results['peak_rss_mb']:.0f} MB > {baseline['peak_rss_mb']:.0f} MB")
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sheets', type=int, default=20, help="distinct synthetic sheets")
+    parser.add_argument('--pages', type=int, default=2, help="pages per sheet")
+    parser.add_argument('--questions-per-page', type=int, default=6)
+    parser.add_argument('--options', type=int, default=4, help="options per multiple choice question (1-4)")
+    parser.add_argument('--marks', default=','.join(MARKS), help="student marks to draw: " + ','.join(MARKS))
+    parser.add_argument('--open-ratio', type=float, default=0.25, help="fraction of open-ended questions")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3, help="measured passes over all sheets")
+    parser.add_argument('--warmup', type=int, default=1, help="unmeasured passes before timing")
+    parser.add_argument('--template', action='store_true',
+                        help="grade sheets of one exam against its registered blank template")
+    parser.add_argument('--font', default=DEFAULT_FONT, help="TrueType font with the ❍ glyph")
+    parser.add_argument('--real-model', action='store_true', help="use EMBEDDING_MODEL instead of the offline stub")
+    parser.add_argument('--backend-drift', action='store_true',
+                        help="only report the cosine drift of the int8 backend against fp32 (with --real-model)")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true', help="store these results as the new baseline")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="allowed slowdown before failing (0.25 = 25%%)")
+    parser.add_argument('--min-delta-ms', type=float, default=0.5, help="ignore per-function slowdowns below this")
+    parser.add_argument('--output', help="also write the results as JSON to this file")
+    args = parser.parse_args()
+
+    if args.backend_drift:
+        if not args.real_model:
+            parser.error("--backend-drift measures the real model: add --real-model")
+        return backend_drift(args)
+
+    results = run(args)
+    report(results)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+            f.write('\n')
+        print(f"baseline saved to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"no baseline at {args.baseline}: run with --save-baseline first")
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline['config'] != results['config']:
+        print("baseline was recorded with a different configuration: not compared")
+        return 2
+
+    found = regressions(results, baseline, args.tolerance, args.min_delta_ms)
+    for regression in found:
+        print(f"REGRESSION {regression}")
+    if found:
+        return 1
+    print(f"no regression against {args.baseline} (tolerance {args.tolerance:.0%})")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,118 @@
+"""Génération de copies d'examen synthétiques (PDF) pour le benchmark.
+
+Les questions sont imprimées comme sur les sujets réels ("1. ...", options "❍a. ...") et les
+marques de l'étudiant sont ajoutées par-dessus :
+- 'check'     : un "x" tracé sur le "❍" de l'option choisie
+- 'underline' : la réponse d'une question ouverte, soulignée d'un trait
+- 'box'       : un rectangle autour d'une option
+- 'ellipse'   : une ellipse autour d'une option
+
+Le sujet imprimé comporte un cadre et un filet entre les questions, comme les formulaires réels.
+Les coches et réponses soulignées sont placées pour être reconnues par extract_page_annotations
+(PyMuPDF 1.21 ne retient un caractère que si sa boîte est entièrement dans la zone capturée).
+"""
+
+import os
+import random
+
+import fitz  # PyMuPDF
+
+DEFAULT_FONT = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '..', '..', 'autograder-backend', 'assets', 'DejaVuSans.ttf'
+)
+MARKS = ('check', 'underline', 'box', 'ellipse')
+
+WORDS = [
+    "Paris", "Lyon", "Rome", "Berlin", "Madrid", "Oslo", "Lisbonne", "Vienne",
+    "soleil", "lune", "eau", "feu", "terre", "vent", "pluie", "neige",
+]
+OPTION_LABELS = "abcd"  # Seules les options a. à d. sont reconnues par QuestionGrouper
+
+# Hauteurs (en points) occupées sur la page
+QUESTION_HEIGHT = 22
+OPTION_HEIGHT = 16
+QUESTION_SPACING = 24
+OPEN_ANSWER_HEIGHT = 30
+OPEN_SPACING = 40
+MARGIN = 60
+
+
+def make_sheet(pages=2, questions_per_page=6, options=4, marks=MARKS, open_ratio=0.25,
+               correct_ratio=0.7, seed=0, student_seed=None, font_file=DEFAULT_FONT):
+    """Générer une copie annotée et son corrigé.
+
+    seed détermine le sujet (questions et options), student_seed les réponses de l'étudiant :
+    les copies d'un même sujet ont le même seed. Sans marques (marks=()), la copie est le
+    sujet vierge. Renvoie (contenu du PDF, corrigé au format attendu par /analyze_qcm).
+    """
+    if not 1 <= options <= len(OPTION_LABELS):
+        raise ValueError(f"options must be between 1 and {len(OPTION_LABELS)}")
+    unknown_marks = set(marks) - set(MARKS)
+    if unknown_marks:
+        raise ValueError(f"Unknown marks: {sorted(unknown_marks)}")
+
+    rnd = random.Random(seed)
+    student = random.Random(seed if student_seed is None else student_seed)
+    doc = fitz.open()
+    correct_answers = []
+    number = 1
+
+    for _ in range(pages):
+        page = doc.new_page()
+        page.insert_font(fontname="dv", fontfile=font_file)
+        page.draw_rect(page.rect + (30, 30, -30, -30))  # Cadre du sujet
+        y = MARGIN
+
+        for _ in range(questions_per_page):
+            if rnd.random() < open_ratio:
+                prompt = f"{number}. Expliquez la question {number} ouverte"
+                reference = " ".join(rnd.sample(WORDS, 2))
+                # Réponse juste, ou réponse au hasard
+                response = reference if student.random() < correct_ratio else " ".join(student.sample(WORDS, 2))
+
+                page.insert_text((50, y), prompt, fontname="dv", fontsize=11)
+                y += OPEN_ANSWER_HEIGHT
+                if 'underline' in marks:
+                    # Texte assez petit pour tenir dans la zone capturée autour du trait
+                    page.insert_text((60, y), response, fontname="dv", fontsize=4)
+                    page.draw_line((58, y + 1.2), (160, y + 1.2))
+                    # La réponse imprimée est regroupée avec l'énoncé par QuestionGrouper
+                    prompt = f"{prompt} {response}"
+                y += OPEN_SPACING
+                correct_answers.append({'question': prompt, 'answer': reference, 'points': 2})
+            else:
+                prompt = f"{number}. Quelle est la question {number} ?"
+                choices = rnd.sample(WORDS, options)
+                correct = rnd.randrange(options)
+                checked = correct if student.random() < correct_ratio else student.randrange(options)
+
+                page.insert_text((50, y), prompt, fontname="dv", fontsize=11)
+                y += QUESTION_HEIGHT
+                for index, choice in enumerate(choices):
+                    page.insert_text((60, y), f"❍{OPTION_LABELS[index]}. {choice}", fontname="dv", fontsize=11)
+                    option_rect = fitz.Rect(55, y - 12, 170, y + 4)
+                    if index == checked:
+                        if 'check' in marks:
+                            # "x" assez grand pour couvrir le "❍" de l'option
+                            page.insert_text((56, y + 4.5), "x", fontname="dv", fontsize=24)
+                        if 'box' in marks:
+                            page.draw_rect(option_rect)
+                    elif index == (checked + 1) % options and 'ellipse' in marks:
+                        page.draw_oval(option_rect)
+                    y += OPTION_HEIGHT
+                y += QUESTION_SPACING
+                correct_answers.append({
+                    'question': prompt,
+                    'answer': f"❍{OPTION_LABELS[correct]}. {choices[correct]}",
+                    'points': 1,
+                })
+
+            if y > page.rect.height - MARGIN:
+                raise ValueError(f"{questions_per_page} questions do not fit on a page")
+            # Filet de séparation du sujet, loin de tout texte
+            page.draw_line((40, y - 16), (page.rect.width - 40, y - 16))
+            number += 1
+
+    pdf_bytes = doc.tobytes()
+    doc.close()
+    return pdf_bytes, correct_answers
@@ -0,0 +1,35 @@
+"""Modèle d'embeddings factice pour lancer le benchmark sans télécharger de modèle."""
+
+import hashlib
+
+import torch
+
+
+class StubSentenceTransformer(torch.nn.Module):
+    """Sac de mots haché : déterministe, même interface encode() que SentenceTransformer."""
+
+    dimension = 384
+
+    def __init__(self, model_name_or_path=None, device=None, **kwargs):
+        super().__init__()
+
+    def encode(self, sentences, convert_to_tensor=False, **kwargs):
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+
+        embeddings = torch.zeros(len(texts), self.dimension)
+        for row, text in enumerate(texts):
+            for word in text.lower().split():
+                column = int.from_bytes(hashlib.md5(word.encode('utf-8')).digest()[:4], 'little') % self.dimension
+                embeddings[row, column] += 1.0
+        embeddings = torch.nn.functional.normalize(embeddings, dim=1)
+
+        if single:
+            embeddings = embeddings[0]
+        return embeddings if convert_to_tensor else embeddings.numpy()
+
+
+def install():
+    """Remplacer SentenceTransformer par le modèle factice (à appeler avant d'importer app)."""
+    import sentence_transformers
+    sentence_transformers.SentenceTransformer = StubSentenceTransformer
@@ -0,0 +1,183 @@
+"""Cache des embeddings des réponses des étudiants.
+
+Dans une classe, beaucoup d'étudiants donnent la même réponse courte (le même mot dans un texte
+à trous) : elle n'est encodée qu'une fois. Les vecteurs sont gardés en mémoire dans chaque
+worker (LRU borné par la taille totale) et, si un répertoire est configuré, dans une table de
+hachage projetée en mémoire (mmap), un fichier par modèle : partagée par les workers à travers
+le cache de pages du système, elle survit aux redémarrages. La clé est l'identifiant du modèle
+et le texte normalisé par l'appelant.
+"""
+
+import fcntl
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class MappedEmbeddingStore:
+    """Table de hachage à correspondance directe dans un fichier : un emplacement par empreinte,
+    écrasé en cas de collision. Les lectures se font dans la projection, sans verrou ; les
+    écritures (des autres workers aussi) sont sérialisées par un verrou sur le fichier."""
+
+    MAGIC = b'EVALEMB1'
+    HEADER = struct.Struct('<8sIQ')  # magic, dimension, nombre d'emplacements
+    KEY_BYTES = 16
+
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._records = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def digest(cls, model_id, text):
+        return hashlib.sha256(f"{model_id}\0{text}".encode('utf-8')).digest()[:cls.KEY_BYTES]
+
+    def _record_dtype(self, dimension):
+        return np.dtype([('key', f'V{self.KEY_BYTES}'), ('vector', '<f4', (dimension,))])
+
+    def _open(self, dimension=None):
+        """Projeter le fichier, créé au premier vecteur écrit. Un fichier existant n'est jamais
+        tronqué : d'autres workers le lisent peut-être."""
+        if self._records is None:
+            self._records = self._map(dimension)
+        if self._records is not None and dimension is not None and self._records.dtype['vector'].shape[0] != dimension:
+            raise ValueError(f"{self.path} holds vectors of another dimension")
+        return self._records
+
+    def _map(self, dimension):
+        with self._lock:
+            if self._records is not None:
+                return self._records
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                header = os.pread(fd, self.HEADER.size, 0)
+                magic, stored_dimension, slots = self.HEADER.unpack(header) if len(header) == self.HEADER.size else (b'', 0, 0)
+                if magic != self.MAGIC:
+                    if dimension is None:
+                        return None
+                    stored_dimension = dimension
+                    slots = max(1, (self.max_bytes - self.HEADER.size) // self._record_dtype(dimension).itemsize)
+                    # Fichier creux : seuls les emplacements écrits occupent le disque
+                    os.ftruncate(fd, self.HEADER.size + slots * self._record_dtype(dimension).itemsize)
+                    os.pwrite(fd, self.HEADER.pack(self.MAGIC, stored_dimension, slots), 0)
+                buffer = mmap.mmap(fd, 0)
+            finally:
+                # mmap garde une copie du descripteur : le verrou doit être levé explicitement
+                fcntl.flock(fd, fcntl.LOCK_UN)
+                os.close(fd)
+            return np.frombuffer(buffer, dtype=self._record_dtype(stored_dimension), count=slots, offset=self.HEADER.size)
+
+    def get_many(self, digests):
+        """Vecteur enregistré pour chaque empreinte, ou None."""
+        records = self._open()
+        if records is None:
+            return [None] * len(digests)
+        vectors = []
+        for digest in digests:
+            record = records[int.from_bytes(digest[:8], 'little') % len(records)]
+            vector = record['vector'].copy() if record['key'].tobytes() == digest else None
+            # Emplacement réécrit pendant la lecture par un autre worker : considéré comme absent
+            if vector is not None and record['key'].tobytes() != digest:
+                vector = None
+            vectors.append(vector)
+        return vectors
+
+    def put_many(self, items):
+        """items : [(empreinte, vecteur)] écrits sous un seul verrou."""
+        records = self._open(len(items[0][1]))
+        record_bytes = records.dtype.itemsize
+        # Écrits avec pwrite plutôt qu'à travers la projection : chaque page touchée d'un fichier
+        # creux y coûte une faute de page et l'allocation d'un bloc
+        fd = os.open(self.path, os.O_RDWR)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            for digest, vector in items:
+                offset = self.HEADER.size + int.from_bytes(digest[:8], 'little') % len(records) * record_bytes
+                # La clé est effacée pendant l'écriture du vecteur : un lecteur ne voit jamais un mélange
+                os.pwrite(fd, bytes(self.KEY_BYTES), offset)
+                os.pwrite(fd, np.asarray(vector, dtype='<f4').tobytes(), offset + self.KEY_BYTES)
+                os.pwrite(fd, digest, offset)
+        finally:
+            os.close(fd)
+
+
+class EmbeddingCache:
+    """Vecteurs (float32) indexés par texte normalisé, éviction LRU au-delà de max_bytes."""
+
+    def __init__(self, model_id, max_bytes, directory=None, max_disk_bytes=0):
+        self.model_id = model_id
+        self.max_bytes = max_bytes
+        self.store = None
+        if directory and max_disk_bytes > 0:
+            file_name = hashlib.sha256(model_id.encode('utf-8')).hexdigest()[:16] + '.bin'
+            self.store = MappedEmbeddingStore(os.path.join(directory, file_name), max_disk_bytes)
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.bytes = 0
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def _entry_bytes(self, key, vector):
+        return vector.nbytes + len(key)
+
+    def get_many(self, keys):
+        """Vecteurs connus : {clé: (vecteur, 'memory' ou 'disk')} ; les clés absentes sont omises."""
+        found = {}
+        with self._lock:
+            for key in keys:
+                vector = self._entries.get(key)
+                if vector is not None:
+                    self._entries.move_to_end(key)
+                    found[key] = (vector, 'memory')
+        missing = [key for key in dict.fromkeys(keys) if key not in found]
+        if self.store is not None and missing:
+            try:
+                vectors = self.store.get_many([self.store.digest(self.model_id, key) for key in missing])
+            except (OSError, ValueError) as e:
+                logger.info(f"Embedding store read failed: {e}")
+                vectors = []
+            for key, vector in zip(missing, vectors):
+                if vector is not None:
+                    self._remember(key, vector)
+                    found[key] = (vector, 'disk')
+        return found
+
+    def put_many(self, items):
+        """items : [(clé, vecteur)] calculés par le modèle."""
+        for key, vector in items:
+            self._remember(key, vector)
+        if self.store is not None and items:
+            try:
+                self.store.put_many([(self.store.digest(self.model_id, key), vector) for key, vector in items])
+            except (OSError, ValueError) as e:
+                logger.info(f"Embedding store write failed: {e}")
+
+    def _remember(self, key, vector):
+        size = self._entry_bytes(key, vector)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.bytes -= self._entry_bytes(key, previous)
+            self._entries[key] = vector
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                old_key, old_vector = self._entries.popitem(last=False)
+                self.bytes -= self._entry_bytes(old_key, old_vector)
@@ -0,0 +1,17 @@
+"""Configuration de gunicorn (image Docker : gunicorn -c gunicorn.conf.py app:app)."""
+
+import os
+
+bind = '0.0.0.0:5000'
+workers = 2
+worker_class = 'gevent'
+timeout = 120
+# Le modèle est chargé une seule fois par le maître, puis partagé par les workers
+preload_app = True
+
+
+def child_exit(server, worker):
+    """Retirer des jauges « live » (taille des caches d'embeddings) le worker arrêté ou redémarré."""
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,228 @@
+"""File d'attente persistante (SQLite) des corrections asynchrones.
+
+Les travaux sont stockés dans une base SQLite locale : plusieurs workers gunicorn peuvent
+vider la même file (la prise d'un travail est atomique) et les travaux en cours au moment
+d'un redémarrage sont remis en file dès que leur bail n'est plus renouvelé.
+"""
+
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(Exception):
+    """Trop de travaux en attente : le client doit réessayer plus tard."""
+
+
+class JobQueue:
+    """File de travaux SQLite vidée par un nombre borné de threads par processus.
+
+    handler(payload, params) reçoit le contenu binaire et les paramètres JSON d'un travail
+    et renvoie un résultat sérialisable en JSON.
+    """
+
+    def __init__(self, db_path, handler, workers=1, max_pending=100, lease_seconds=60,
+                 max_attempts=3, retention_seconds=86400, poll_interval=1.0):
+        self.db_path = db_path
+        self.handler = handler
+        self.workers = workers
+        self.max_pending = max_pending
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retention_seconds = retention_seconds
+        self.poll_interval = poll_interval
+
+        self._lock = threading.Lock()
+        self._started_pid = None
+        self._owner = None
+        self._initialized = False
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _init_db(self):
+        if self._initialized:
+            return
+        directory = os.path.dirname(self.db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    payload BLOB,
+                    params TEXT NOT NULL,
+                    result TEXT,
+                    error TEXT,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    owner TEXT,
+                    claimed_at REAL,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+        finally:
+            conn.close()
+        self._initialized = True
+
+    def start(self):
+        """Démarrer les threads du processus courant (une seule fois par processus, après le fork)."""
+        if self._started_pid == os.getpid():
+            return
+        with self._lock:
+            if self._started_pid == os.getpid():
+                return
+            self._init_db()
+            self._owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+            threads = [threading.Thread(target=self._run, daemon=True) for _ in range(self.workers)]
+            threads.append(threading.Thread(target=self._heartbeat, daemon=True))
+            self._started_pid = os.getpid()
+        # Démarrés hors du verrou : sous gevent, start() passe la main aux autres requêtes, et le
+        # verrou, créé avant que gevent ne patche threading, bloquerait alors tout le worker
+        for thread in threads:
+            thread.start()
+
+    def submit(self, payload, params):
+        """Ajouter un travail à la file et renvoyer son identifiant."""
+        self._init_db()
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            pending = conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status IN ('queued', 'running')"
+            ).fetchone()[0]
+            if pending >= self.max_pending:
+                conn.execute("ROLLBACK")
+                raise QueueFullError(f"{pending} jobs pending")
+            conn.execute(
+                "INSERT INTO jobs (id, status, payload, params, created_at, updated_at) VALUES (?, 'queued', ?, ?, ?, ?)",
+                (job_id, sqlite3.Binary(payload), json.dumps(params), now, now),
+            )
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+        return job_id
+
+    def get(self, job_id):
+        """État d'un travail, ou None s'il est inconnu."""
+        self._init_db()
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT id, status, result, error, attempts, created_at, updated_at FROM jobs WHERE id = ?",
+                (job_id,),
+            ).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            return None
+
+        job = {
+            'job_id': row['id'],
+            'status': row['status'],
+            'attempts': row['attempts'],
+            'created_at': row['created_at'],
+            'updated_at': row['updated_at'],
+        }
+        if row['result'] is not None:
+            job['results'] = json.loads(row['result'])
+        if row['error'] is not None:
+            job['error'] = row['error']
+        return job
+
+    def _claim(self):
+        """Prendre atomiquement le plus ancien travail en attente."""
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            # Travaux dont le bail a expiré (processus arrêté ou redémarré) : les remettre en file
+            conn.execute(
+                "UPDATE jobs SET status = 'failed', error = 'Too many attempts', payload = NULL, updated_at = ? "
+                "WHERE status = 'running' AND claimed_at < ? AND attempts >= ?",
+                (now, now - self.lease_seconds, self.max_attempts),
+            )
+            conn.execute(
+                "UPDATE jobs SET status = 'queued', owner = NULL, updated_at = ? "
+                "WHERE status = 'running' AND claimed_at < ?",
+                (now, now - self.lease_seconds),
+            )
+            row = conn.execute(
+                "SELECT id, payload, params FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1"
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE jobs SET status = 'running', owner = ?, claimed_at = ?, attempts = attempts + 1, updated_at = ? "
+                    "WHERE id = ?",
+                    (self._owner, now, now, row['id']),
+                )
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+        return row
+
+    def _finish(self, job_id, status, result=None, error=None):
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, payload = NULL, owner = NULL, updated_at = ? "
+                "WHERE id = ? AND owner = ?",
+                (status, None if result is None else json.dumps(result), error, now, job_id, self._owner),
+            )
+            # Supprimer les travaux terminés depuis plus longtemps que la durée de conservation
+            conn.execute(
+                "DELETE FROM jobs WHERE status IN ('done', 'failed') AND updated_at < ?",
+                (now - self.retention_seconds,),
+            )
+        finally:
+            conn.close()
+
+    def _run(self):
+        while True:
+            try:
+                row = self._claim()
+            except sqlite3.Error as e:
+                logger.info(f"Job queue error: {e}")
+                row = None
+            if row is None:
+                time.sleep(self.poll_interval)
+                continue
+
+            job_id = row['id']
+            try:
+                result = self.handler(bytes(row['payload']), json.loads(row['params']))
+                self._finish(job_id, 'done', result=result)
+            except Exception as e:
+                logger.info(f"Job {job_id} failed: {e}")
+                self._finish(job_id, 'failed', error=str(e))
+
+    def _heartbeat(self):
+        """Renouveler le bail des travaux en cours dans ce processus."""
+        while True:
+            time.sleep(self.lease_seconds / 3)
+            conn = self._connect()
+            try:
+                conn.execute(
+                    "UPDATE jobs SET claimed_at = ? WHERE status = 'running' AND owner = ?",
+                    (time.time(), self._owner),
+                )
+            except sqlite3.Error as e:
+                logger.info(f"Job queue heartbeat error: {e}")
+            finally:
+                conn.close()
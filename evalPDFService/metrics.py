@@ -0,0 +1,114 @@
+"""Métriques Prometheus du service de correction, exposées sur /metrics.
+
+Avec gunicorn, chaque worker (et chaque processus du pool d'analyse) a ses propres compteurs :
+si PROMETHEUS_MULTIPROC_DIR est défini, les valeurs sont écrites dans ce répertoire et
+agrégées à chaque lecture de /metrics, quel que soit le worker qui répond. Sans cette
+variable, /metrics ne montre que les valeurs du worker qui traite la requête.
+"""
+
+import os
+
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, generate_latest
+from prometheus_client import multiprocess
+
+MULTIPROC_DIR = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+
+
+def reset_multiprocess_dir():
+    """Supprimer au démarrage les métriques laissées par les processus d'une exécution précédente."""
+    if not MULTIPROC_DIR:
+        return
+    os.makedirs(MULTIPROC_DIR, exist_ok=True)
+    for name in os.listdir(MULTIPROC_DIR):
+        if name.endswith('.db'):
+            os.remove(os.path.join(MULTIPROC_DIR, name))
+
+
+# Le module est importé une seule fois, par le maître gunicorn (--preload), avant le fork des workers
+reset_multiprocess_dir()
+
+# Durée de chaque étape de la correction d'une copie
+STAGE_SECONDS = Histogram(
+    'evalpdf_stage_seconds',
+    'Time spent in each grading stage (comparison includes embedding)',
+    ['stage'],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+
+# Taille des copies analysées
+SHEET_PAGES = Histogram(
+    'evalpdf_sheet_pages', 'Pages per analyzed sheet',
+    buckets=(1, 2, 4, 8, 16, 32, 64),
+)
+SHEET_QUESTIONS = Histogram(
+    'evalpdf_sheet_questions', 'Printed questions per analyzed sheet',
+    buckets=(1, 5, 10, 20, 50, 100, 200),
+)
+SHEET_ANNOTATIONS = Histogram(
+    'evalpdf_sheet_annotations', 'Student marks per analyzed sheet',
+    buckets=(0, 5, 10, 20, 50, 100, 200, 500),
+)
+
+# Appels au modèle d'embeddings (un appel encode un lot de textes)
+MODEL_CALLS = Counter('evalpdf_model_calls', 'Calls to the embedding model')
+MODEL_TEXTS = Counter('evalpdf_model_texts', 'Texts encoded by the embedding model')
+
+# Pages de copie comparées au sujet vierge enregistré
+TEMPLATE_PAGES = Counter('evalpdf_template_pages', 'Sheet pages compared with a registered blank template', ['result'])
+
+# Résultats de correction lus dans le cache (hit), absents (miss) ou ignorés à la demande du client (bypass)
+RESULT_CACHE = Counter('evalpdf_result_cache', 'Result cache lookups', ['result'])
+
+# Embeddings lus dans le cache du worker (memory), dans le fichier partagé (disk), ou calculés (miss)
+EMBEDDING_CACHE = Counter('evalpdf_embedding_cache', 'Embedding cache lookups', ['result'])
+# Mémoire occupée par les vecteurs en cache, additionnée sur les workers en vie
+EMBEDDING_CACHE_BYTES = Gauge(
+    'evalpdf_embedding_cache_bytes', 'Memory used by the embedding caches of the workers', multiprocess_mode='livesum',
+)
+
+
+def timed(stage):
+    """Chronométrer une étape (utilisable comme décorateur ou avec 'with')."""
+    return STAGE_SECONDS.labels(stage).time()
+
+
+def observe_stage(stage, seconds):
+    STAGE_SECONDS.labels(stage).observe(seconds)
+
+
+def observe_sheet(pages, questions, annotations):
+    SHEET_PAGES.observe(pages)
+    SHEET_QUESTIONS.observe(questions)
+    SHEET_ANNOTATIONS.observe(annotations)
+
+
+def observe_template_pages(statuses):
+    """statuses : 'matched', 'scanned' ou 'unmatched' pour chaque page de la copie."""
+    for status in statuses:
+        TEMPLATE_PAGES.labels(status).inc()
+
+
+def observe_result_cache(result):
+    RESULT_CACHE.labels(result).inc()
+
+
+def observe_embedding_cache(results, cache_bytes):
+    """results : 'memory', 'disk' ou 'miss' pour chaque texte distinct."""
+    for result in results:
+        EMBEDDING_CACHE.labels(result).inc()
+    EMBEDDING_CACHE_BYTES.set(cache_bytes)
+
+
+def observe_model_call(texts):
+    MODEL_CALLS.inc()
+    MODEL_TEXTS.inc(texts)
+
+
+def latest_metrics():
+    """Contenu et type de la réponse /metrics."""
+    if MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -0,0 +1,105 @@
+"""Lecture optique (OMR) des copies scannées.
+
+Une page scannée n'a ni texte ni tracés : elle est rendue une seule fois en niveaux de gris et
+l'encre est séparée du fond par un seuillage adaptatif. L'encre déjà présente sur le sujet vierge
+(rendu à la même résolution, élargi pour tolérer un léger décalage) est retirée, puis le taux de
+remplissage de toutes les zones connues (cases des options, zones de réponse) est calculé en une
+fois à partir de l'image intégrale. Seules les zones de réponse encrées sont passées à Tesseract.
+"""
+
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import fitz  # PyMuPDF
+import numpy as np
+import pytesseract
+
+MIN_DPI = 72
+MAX_DPI = 300
+BUBBLE_PIXELS = 16  # Hauteur minimale (en pixels) d'une case d'option dans le rendu
+OCR_DPI = 200  # Résolution minimale du rendu quand une zone de réponse doit être lue par Tesseract
+
+
+def native_dpi(page):
+    """Résolution de la plus grande image de la page (le scan), ou None s'il n'y en a pas."""
+    best_area, dpi = 0, None
+    for info in page.get_image_info():
+        x0, y0, x1, y1 = info['bbox']
+        area = (x1 - x0) * (y1 - y0)
+        if area > best_area:
+            best_area, dpi = area, info['width'] * 72 / (x1 - x0)
+    return dpi
+
+
+def page_dpi(page, min_bubble_height, ocr):
+    """Résolution du rendu : juste assez pour les cases (et la lecture des réponses si ocr),
+    sans dépasser la résolution du scan."""
+    dpi = BUBBLE_PIXELS * 72 / min_bubble_height if min_bubble_height else MIN_DPI
+    if ocr:
+        dpi = max(dpi, OCR_DPI)
+    scan_dpi = native_dpi(page)
+    if scan_dpi:
+        dpi = min(dpi, scan_dpi)
+    return int(max(MIN_DPI, min(MAX_DPI, math.ceil(dpi))))
+
+
+def render_gray(page, dpi):
+    """Rendu de la page en niveaux de gris (tableau hauteur x largeur)."""
+    pixmap = page.get_pixmap(dpi=dpi, colorspace=fitz.csGRAY, alpha=False)
+    return np.frombuffer(pixmap.samples, dtype=np.uint8).reshape(pixmap.height, pixmap.stride)[:, :pixmap.width]
+
+
+def ink_mask(gray, dpi):
+    """Masque d'encre de la page (1 = encre)."""
+    # Seuillage adaptatif sur un voisinage d'environ un demi-pouce : insensible à l'éclairage des photos
+    block_size = max(3, int(dpi / 2) | 1)
+    return cv2.adaptiveThreshold(np.ascontiguousarray(gray), 1, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY_INV, block_size, 15)
+
+
+def printed_mask(gray, dpi):
+    """Masque de l'encre imprimée du sujet vierge, élargi d'environ un millimètre."""
+    size = max(3, int(dpi / 25) | 1)
+    return cv2.dilate(ink_mask(gray, dpi), np.ones((size, size), np.uint8))
+
+
+def new_ink_integral(gray, printed, dpi):
+    """Image intégrale de l'encre absente du sujet vierge : la somme sur tout rectangle en 4 lectures."""
+    mask = ink_mask(gray, dpi)
+    if printed is not None and printed.shape == mask.shape:
+        mask &= 1 - printed
+    return cv2.integral(mask)
+
+
+def fill_ratios(integral, rects, dpi):
+    """Proportion d'encre dans chaque rectangle (en points, tableau N x 4)."""
+    if len(rects) == 0:
+        return np.zeros(0)
+    height, width = integral.shape[0] - 1, integral.shape[1] - 1
+    pixels = np.rint(np.asarray(rects, dtype=float) * (dpi / 72)).astype(int)
+    x0, y0, x1, y1 = (np.clip(pixels[:, i], 0, limit) for i, limit in enumerate((width, height, width, height)))
+    sums = integral[y1, x1] - integral[y0, x1] - integral[y1, x0] + integral[y0, x0]
+    areas = np.maximum((x1 - x0) * (y1 - y0), 1)
+    return sums / areas
+
+
+def crop(gray, rect, dpi):
+    x0, y0, x1, y1 = (int(round(coordinate * dpi / 72)) for coordinate in rect)
+    return gray[max(y0, 0):y1, max(x0, 0):x1]
+
+
+_ocr_pool = None
+_ocr_pool_pid = None
+
+
+def ocr_images(images, lang, workers):
+    """Lire le texte de plusieurs images en parallèle (chaque appel lance un processus tesseract)."""
+    global _ocr_pool, _ocr_pool_pid
+    if not images:
+        return []
+    # Les threads ne survivent pas au fork : un pool par processus
+    if _ocr_pool_pid != os.getpid():
+        _ocr_pool = ThreadPoolExecutor(max_workers=workers)
+        _ocr_pool_pid = os.getpid()
+    return list(_ocr_pool.map(lambda image: pytesseract.image_to_string(image, lang=lang, config='--psm 6'), images))
@@ -0,0 +1,100 @@
+"""Réponses extraites des copies, conservées pour les corriger à nouveau sans relire les PDF.
+
+Quand le corrigé d'un examen change (faute de frappe, barème), seules les réponses associées
+aux questions (sortie de associate_responses_with_questions) sont comparées au nouveau corrigé.
+Elles sont stockées par identifiant de copie dans une base SQLite, en JSON compressé (zlib),
+avec l'empreinte du PDF dont elles ont été extraites.
+"""
+
+import json
+import os
+import sqlite3
+import time
+import zlib
+
+
+class ResponseStore:
+    """Réponses associées de chaque copie (sheet_id), regroupées par examen (exam_id) si connu."""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._initialized = False
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+
+    def _init_db(self):
+        if self._initialized:
+            return
+        directory = os.path.dirname(self.db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS responses (
+                    sheet_id TEXT PRIMARY KEY,
+                    exam_id TEXT,
+                    pdf_sha256 TEXT NOT NULL,
+                    responses BLOB NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS responses_exam ON responses (exam_id)")
+        finally:
+            conn.close()
+        self._initialized = True
+
+    def put(self, sheet_id, exam_id, pdf_sha256, associated_responses):
+        self._init_db()
+        data = zlib.compress(json.dumps(associated_responses, separators=(',', ':')).encode('utf-8'))
+        conn = self._connect()
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (sheet_id, exam_id, pdf_sha256, responses, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (sheet_id, exam_id, pdf_sha256, sqlite3.Binary(data), time.time()),
+            )
+        finally:
+            conn.close()
+
+    def contains(self, sheet_id, pdf_sha256):
+        """Réponses de cette copie déjà extraites de ce PDF."""
+        self._init_db()
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT 1 FROM responses WHERE sheet_id = ? AND pdf_sha256 = ?", (sheet_id, pdf_sha256)
+            ).fetchone()
+        finally:
+            conn.close()
+        return row is not None
+
+    def get_many(self, sheet_ids):
+        """Réponses associées des copies demandées : {sheet_id: réponses} (copies inconnues absentes)."""
+        self._init_db()
+        found = {}
+        conn = self._connect()
+        try:
+            # Par paquets : SQLite limite le nombre de paramètres d'une requête
+            for start in range(0, len(sheet_ids), 500):
+                chunk = sheet_ids[start:start + 500]
+                rows = conn.execute(
+                    f"SELECT sheet_id, responses FROM responses WHERE sheet_id IN ({','.join('?' * len(chunk))})",
+                    chunk,
+                )
+                for sheet_id, data in rows:
+                    found[sheet_id] = json.loads(zlib.decompress(data))
+        finally:
+            conn.close()
+        return found
+
+    def sheet_ids(self, exam_id):
+        """Copies enregistrées pour un examen."""
+        self._init_db()
+        conn = self._connect()
+        try:
+            rows = conn.execute("SELECT sheet_id FROM responses WHERE exam_id = ? ORDER BY sheet_id", (exam_id,)).fetchall()
+        finally:
+            conn.close()
+        return [sheet_id for sheet_id, in rows]
@@ -0,0 +1,110 @@
+"""Cache persistant (SQLite) des résultats de correction.
+
+Une copie déjà corrigée avec le même corrigé est renvoyée sans être analysée à nouveau : le
+backend renvoie le même PDF quand un enseignant rouvre une copie ou qu'une requête est
+relancée. La clé est calculée par l'appelant à partir du contenu (empreinte du PDF, du corrigé,
+...). La base est partagée par les workers gunicorn ; les résultats les moins récemment lus
+sont supprimés quand la taille totale dépasse la limite.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class ResultCache:
+    """Résultats JSON indexés par clé, éviction LRU bornée par la taille totale (max_bytes)."""
+
+    evict_ratio = 0.9  # Taille visée (part de max_bytes) après une éviction
+
+    def __init__(self, db_path, max_bytes):
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self._initialized = False
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+
+    def _init_db(self):
+        if self._initialized:
+            return
+        directory = os.path.dirname(self.db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS results (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    used_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS results_used_at ON results (used_at)")
+        finally:
+            conn.close()
+        self._initialized = True
+
+    def get(self, key):
+        """Résultat enregistré sous key, ou None (le cache ne doit jamais empêcher une correction)."""
+        try:
+            self._init_db()
+            conn = self._connect()
+            try:
+                row = conn.execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone()
+                if row is None:
+                    return None
+                conn.execute("UPDATE results SET used_at = ? WHERE key = ?", (time.time(), key))
+            finally:
+                conn.close()
+        except (sqlite3.Error, OSError) as e:
+            logger.info(f"Result cache read failed: {e}")
+            return None
+        return json.loads(row[0])
+
+    def put(self, key, value):
+        """Enregistrer un résultat puis supprimer les plus anciens au-delà de max_bytes."""
+        data = json.dumps(value)
+        if len(data) > self.max_bytes:
+            return
+        try:
+            self._put(key, data)
+        except (sqlite3.Error, OSError) as e:
+            logger.info(f"Result cache write failed: {e}")
+
+    def _put(self, key, data):
+        self._init_db()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                "INSERT OR REPLACE INTO results (key, value, size, used_at) VALUES (?, ?, ?, ?)",
+                (key, data, len(data), time.time()),
+            )
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+            if total > self.max_bytes:
+                # Libérer un peu plus que nécessaire pour ne pas évincer à chaque ajout
+                target = self.max_bytes * self.evict_ratio
+                evicted = 0
+                while total > target:
+                    oldest = conn.execute("SELECT key, size FROM results ORDER BY used_at LIMIT 100").fetchall()
+                    for old_key, size in oldest:
+                        if total <= target:
+                            break
+                        conn.execute("DELETE FROM results WHERE key = ?", (old_key,))
+                        total -= size
+                        evicted += 1
+                logger.debug("Result cache: %s entries evicted", evicted)
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
@@ -0,0 +1,23 @@
+"""Tests de evalPDFService : le modèle factice du benchmark remplace le modèle d'embeddings.
+
+    python -m pytest tests
+"""
+
+import os
+import sys
+import tempfile
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVICE_DIR)
+sys.path.insert(0, os.path.join(SERVICE_DIR, 'benchmark'))
+
+# Bases et fichiers du service hors de /data, avant l'import de app
+_work_dir = tempfile.mkdtemp()
+for name, file_name in (('JOBS_DB_PATH', 'jobs.sqlite3'), ('RESULTS_CACHE_PATH', 'results.sqlite3'),
+                        ('RESPONSES_DB_PATH', 'responses.sqlite3'), ('ANSWER_KEYS_DIR', 'answer_keys'),
+                        ('TEMPLATES_DIR', 'templates')):
+    os.environ.setdefault(name, os.path.join(_work_dir, file_name))
+
+import stub_model  # noqa: E402
+
+stub_model.install()
@@ -0,0 +1,48 @@
+import json
+
+import pytest
+
+import app
+
+CORRECT_ANSWERS = [{'question': '1. Quelle est la question 1 ?', 'answer': '❍a. feu', 'points': 2}]
+
+
+def test_inline_answer_key_takes_precedence_over_exam_id():
+    # Sujet vierge enregistré pour l'examen, sans corrigé enregistré
+    with app.app.test_request_context('/analyze_qcm', method='POST', data={
+            'exam_id': 'exam-without-key', 'correct_answers': json.dumps(CORRECT_ANSWERS)}):
+        answer_key = app.request_answer_key()
+    assert answer_key.answers == app.clean_correct_answers(CORRECT_ANSWERS)
+
+
+def test_exam_id_alone_uses_the_registered_key():
+    with app.app.test_request_context('/analyze_qcm', method='POST', data={'exam_id': 'exam-without-key'}):
+        with pytest.raises(app.AnswerKeyError) as error:
+            app.request_answer_key()
+    assert error.value.status_code == 404
+
+
+def test_regrade_uses_inline_answer_key_with_exam_id():
+    # Copies de l'examen conservées par /analyze_qcm, sans corrigé enregistré
+    associated = [{'question': CORRECT_ANSWERS[0]['question'], 'response': 'feu', 'page_num': 0,
+                   'question_rect': {'x0': 50.0, 'y0': 50.0, 'x1': 200.0, 'y1': 130.0},
+                   'type': 'multiple_choice', 'option': '❍a. feu'}]
+    app.response_store.put('regrade-sheet', 'regrade-exam', 'sha', associated)
+    response = app.app.test_client().post('/regrade', json={
+        'exam_id': 'regrade-exam', 'correct_answers': CORRECT_ANSWERS})
+    assert response.status_code == 200
+    results = response.get_json()['results']
+    assert list(results) == ['regrade-sheet']
+    assert [result['points'] for result in results['regrade-sheet']['results']] == [2]
+
+
+def test_registered_versions_resolve_from_disk():
+    first = app.register_answer_key('versioned-exam', CORRECT_ANSWERS)
+    second = app.register_answer_key('versioned-exam', [dict(CORRECT_ANSWERS[0], points=3)])
+    # Autre worker, ou redémarrage : rien en mémoire
+    app._answer_keys.clear()
+    assert app.get_answer_key('versioned-exam', first).answers[0]['points'] == 2
+    assert app.get_answer_key('versioned-exam').version == second
+    with pytest.raises(app.AnswerKeyError) as error:
+        app.get_answer_key('versioned-exam', '0' * 16)
+    assert error.value.status_code == 409
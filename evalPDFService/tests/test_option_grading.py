@@ -0,0 +1,71 @@
+import fitz  # PyMuPDF
+
+import app
+
+QUESTIONS = [
+    {'question': '1. Quelle est la question 1 ?', 'options': ['❍a. feu x', '❍b. terre', '❍c. neige', '❍d. vent'],
+     'bbox': (50, 50, 200, 130), 'page_num': 0, 'type': 'multiple_choice'},
+    {'question': '9. Quelle est la question 9 ?', 'options': ['❍a. pluie', '❍b. feu', '❍c. eau', '❍d. lune'],
+     'bbox': (50, 560, 200, 640), 'page_num': 0, 'type': 'multiple_choice'},
+]
+ANSWER_KEY = [
+    {'question': '1. Quelle est la question 1 ?', 'answer': '❍a. feu', 'points': 2},
+    {'question': '9. Quelle est la question 9 ?', 'answer': '❍b. feu', 'points': 2},
+]
+
+
+def check(text, y):
+    return {'type': 'manual_check', 'symbol': 'x', 'text_symbol': 'x', 'rect': fitz.Rect(56, y, 70, y + 28),
+            'page_num': 0, 'text': text}
+
+
+def grade(annotations):
+    associated = app.associate_responses_with_questions(QUESTIONS, {0: annotations})
+    answer_key = app.AnswerKey(app.clean_correct_answers(ANSWER_KEY))
+    return associated, app.compare_responses_batch([associated], answer_key)[0]
+
+
+def test_check_without_text_is_not_credited():
+    associated, results = grade([check('.', 64)])
+    assert associated == []
+    assert sum(result['points'] for result in results) == 0
+
+
+def test_truncated_check_goes_to_the_nearest_question():
+    # ". fe" est contenu dans les options des deux questions : chaque coche va à la question qui l'entoure
+    associated, results = grade([check('. fe', 64), check('. fe', 582)])
+    assert [entry['question'] for entry in associated] == [QUESTIONS[0]['question'], QUESTIONS[1]['question']]
+    assert [result['points'] for result in results] == [2, 2]
+
+
+def test_ambiguous_text_does_not_select_an_option():
+    # "e" est contenu dans plusieurs options de la question 9 : aucune option n'est retenue
+    assert app.matched_option(QUESTIONS[1], 'e') is None
+    assert app.matched_option(QUESTIONS[1], '') is None
+    assert app.matched_option(QUESTIONS[1], 'lune') == '❍d. lune'
+
+
+def test_question_is_credited_once_per_sheet():
+    _, results = grade([check('. fe', 64), check('. feu', 70)])
+    assert len(results) == 2
+    assert sum(result['points'] for result in results) == 2
+
+
+def test_marks_on_true_false_and_underline_questions_are_graded_by_option():
+    questions = [
+        {'question': '2. Vrai ou Faux : la neige est froide.', 'options': ['❍a. Vrai', '❍b. Faux'],
+         'bbox': (50, 200, 200, 260), 'page_num': 0, 'type': 'true_false'},
+        {'question': '3. Soulignez la capitale de la France.', 'options': ['❍a. Lyon', '❍b. Paris'],
+         'bbox': (50, 300, 200, 360), 'page_num': 0, 'type': 'highlight_the_correct_answer'},
+    ]
+    underline = {'type': 'manual_line', 'rect': fitz.Rect(56, 330, 120, 345), 'page_num': 0, 'text_above': 'Paris'}
+    associated = app.associate_responses_with_questions(questions, {0: [check('. Vrai', 214), underline]})
+    assert [(entry['type'], entry['option']) for entry in associated] == [
+        ('true_false', '❍a. Vrai'), ('highlight_the_correct_answer', '❍b. Paris')]
+
+    answer_key = app.AnswerKey(app.clean_correct_answers([
+        {'question': questions[0]['question'], 'answer': '❍a. Vrai', 'points': 1},
+        {'question': questions[1]['question'], 'answer': '❍b. Paris', 'points': 1},
+    ]))
+    results = app.compare_responses_batch([associated], answer_key)[0]
+    assert [(result['strategy'], result['points']) for result in results] == [('option', 1), ('option', 1)]